@@ -132,8 +132,28 @@ export const deleteChannel = async (id) => {
     return response.data;
 }
 
-export const getMessages = async (channelId) => {
-    const response = await api.get(`/channels/${channelId}/messages`);
+// Changes after version since: { changes, version, has_more, reset }; without since, just the current version
+export const getChanges = async (since = null, limit = null) => {
+    const params = {};
+    if (since !== null) params.since = since;
+    if (limit) params.limit = limit;
+    const response = await api.get('/sync', { params });
+    return response.data;
+};
+
+// Moves the read marker to messageId (the newest message when omitted); returns { unread_count, last_read_message_id }
+export const markChannelRead = async (channelId, messageId = null) => {
+    const response = await api.post(`/channels/${channelId}/read`, messageId ? { message_id: messageId } : {});
+    return response.data;
+};
+
+// Returns one page { items, has_more, next_cursor }; pass next_cursor back as beforeId for older messages
+export const getMessages = async (channelId, { beforeId, afterId, limit } = {}) => {
+    const params = {};
+    if (beforeId) params.before_id = beforeId;
+    if (afterId) params.after_id = afterId;
+    if (limit) params.limit = limit;
+    const response = await api.get(`/channels/${channelId}/messages`, { params });
     return response.data;
 };
 
@@ -172,11 +192,26 @@ export const getUsers = async () => {
     return response.data;
 }
 
+// One page of the roster { items, has_more, next_cursor }; pass next_cursor back as afterId
+export const getChannelMembers = async (channelId, { afterId, limit } = {}) => {
+    const params = {};
+    if (afterId) params.after_id = afterId;
+    if (limit) params.limit = limit;
+    const response = await api.get(`/channels/${channelId}/members`, { params });
+    return response.data;
+};
+
 export const addChannelMember = async (channelId, username) => {
     const response = await api.post(`/channels/${channelId}/members`, { username });
     return response.data;
 };
 
+// Adds several users in one request: { user_ids, unchanged, not_found }
+export const addChannelMembers = async (channelId, usernames) => {
+    const response = await api.post(`/channels/${channelId}/members:bulk`, { usernames });
+    return response.data;
+};
+
 export const removeChannelMember = async (channelId, userId) => {
     const response = await api.delete(`/channels/${channelId}/members/${userId}`);
     return response.data;
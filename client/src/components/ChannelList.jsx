@@ -34,7 +34,19 @@ function ChannelList({ channels, activeChannelId, onSelectChannel, onCreateChann
                         onClick={() => onSelectChannel(channel.id)}
                         style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center' }}
                     >
-                        <span># {channel.name}</span>
+                        <span style={{ minWidth: 0, overflow: 'hidden' }}>
+                            <div># {channel.name}</div>
+                            {channel.last_message && (
+                                <div style={{ fontSize: '0.75rem', fontWeight: 400, color: 'var(--text-secondary)', whiteSpace: 'nowrap', overflow: 'hidden', textOverflow: 'ellipsis' }}>
+                                    {channel.last_message.username ? `${channel.last_message.username}: ` : ''}{channel.last_message.content || '📎'}
+                                </div>
+                            )}
+                        </span>
+                        {channel.unread_count > 0 && activeChannelId !== channel.id && (
+                            <span className="unread-badge" style={{ marginLeft: 'auto', marginRight: '0.25rem' }}>
+                                {channel.unread_count > 99 ? '99+' : channel.unread_count}
+                            </span>
+                        )}
                         {(user.is_admin || channel.created_by === user.id) && (
                             <button
                                 onClick={(e) => { e.stopPropagation(); onDeleteChannel(channel.id); }}
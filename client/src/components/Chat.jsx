@@ -2,15 +2,34 @@ import React, { useState, useEffect, useRef } from 'react';
 import ChannelList from './ChannelList';
 import ChatArea from './ChatArea';
 import Modal from './Modal';
-import { getChannels, createChannel, getMessages, sendMessage, deleteMessage, deleteChannel, createUser, getUsers, deleteUser, updatePassword, addChannelMember, removeChannelMember, updateUser, resetPassword, updateProfile, resetMyPassword, verifyEmailChange, getSMTPSettings, updateSMTPSettings } from '../api';
+import { getChannels, createChannel, getMessages, getChanges, markChannelRead, sendMessage, deleteMessage, deleteChannel, createUser, getUsers, deleteUser, updatePassword, getChannelMembers, addChannelMembers, removeChannelMember, updateUser, resetPassword, updateProfile, resetMyPassword, verifyEmailChange, getSMTPSettings, updateSMTPSettings } from '../api';
 
 function Chat({ user, onLogout, serverUrl, onDisconnect }) {
     const [channels, setChannels] = useState([]);
     const [activeChannelId, setActiveChannelId] = useState(null);
     const [messages, setMessages] = useState([]);
+    // Cursor for the next older page of the active channel, null when the start is reached
+    const [olderCursor, setOlderCursor] = useState(null);
+    const loadingOlderRef = useRef(false);
     const [users, setUsers] = useState([]);
     const wsRef = useRef(null);
     const activeChannelRef = useRef(null);
+    // temp_id -> { resolve, reject } for frames waiting for the server's ack
+    const pendingFramesRef = useRef(new Map());
+    // Server epoch and last seen sequence number per channel, for replay on reconnect
+    const epochRef = useRef(null);
+    const seqsRef = useRef({});
+    const helloSeqsRef = useRef({});
+    // Presence and typing come only over the socket: online user ids of the
+    // active channel and "user_id:channel_id" -> { username, channelId, expires }
+    const [onlineUserIds, setOnlineUserIds] = useState(new Set());
+    const [typingUsers, setTypingUsers] = useState({});
+    const lastTypingSentRef = useRef(0);
+    // Change log version the loaded state reflects; after being offline only the changes since it are fetched
+    const syncVersionRef = useRef(null);
+    const syncingRef = useRef(false);
+    // Read markers are sent at most once a second while messages keep arriving
+    const markReadTimerRef = useRef(null);
 
     // Modal state
     const [modal, setModal] = useState({
@@ -50,6 +69,8 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
     }, [activeChannelId]);
 
     useEffect(() => {
+        // The version is taken before the channels load, so nothing between the two is missed
+        getChanges().then(page => { syncVersionRef.current = page.version; }).catch(err => console.error(err));
         loadChannels();
         if (user.is_admin) {
             loadUsers();
@@ -60,35 +81,94 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
         if (!serverUrl) return;
 
         let ws = null;
-        try {
-            const wsUrl = serverUrl.replace(/^http/, 'ws') + '/ws';
-            console.log("Connecting to WebSocket:", wsUrl);
-            ws = new WebSocket(wsUrl);
-            wsRef.current = ws;
+        let reconnectTimer = null;
+        let reconnectDelay = 1000;
+        let stopped = false;
 
-            ws.onopen = () => console.log("WebSocket connected");
-            ws.onmessage = (event) => {
-                try {
-                    handleWsMessage(JSON.parse(event.data));
-                } catch (e) {
-                    console.error("Failed to parse WS message", e);
+        const connect = () => {
+            try {
+                // The server rejects sockets without a valid token
+                const token = localStorage.getItem('token');
+                const params = new URLSearchParams();
+                if (token) params.set('token', token);
+                // After a drop, ask the server to replay only the events we missed
+                if (epochRef.current) {
+                    params.set('resume', JSON.stringify({ epoch: epochRef.current, seqs: seqsRef.current }));
                 }
-            };
-            ws.onerror = (err) => console.error("WebSocket error:", err);
-            ws.onclose = () => console.log("WebSocket closed");
-        } catch (err) {
-            console.error("Failed to initialize WebSocket:", err);
-        }
+                const wsUrl = serverUrl.replace(/^http/, 'ws') + '/ws?' + params.toString();
+                console.log("Connecting to WebSocket");
+                ws = new WebSocket(wsUrl);
+                wsRef.current = ws;
 
-        return () => ws?.close();
+                ws.onopen = () => {
+                    console.log("WebSocket connected");
+                    reconnectDelay = 1000;
+                    requestPresence(activeChannelRef.current);
+                    syncChanges();
+                };
+                ws.onmessage = (event) => {
+                    try {
+                        const data = JSON.parse(event.data);
+                        // Busy channels may send several events in one array frame
+                        if (Array.isArray(data)) data.forEach(handleWsMessage);
+                        else handleWsMessage(data);
+                    } catch (e) {
+                        console.error("Failed to parse WS message", e);
+                    }
+                };
+                ws.onerror = (err) => console.error("WebSocket error:", err);
+                ws.onclose = () => {
+                    console.log("WebSocket closed");
+                    // Frames sent on this socket will never be acknowledged
+                    pendingFramesRef.current.forEach(p => p.reject(new Error("WebSocket closed")));
+                    pendingFramesRef.current.clear();
+                    if (stopped) return;
+                    reconnectTimer = setTimeout(connect, reconnectDelay);
+                    reconnectDelay = Math.min(reconnectDelay * 2, 30000);
+                };
+            } catch (err) {
+                console.error("Failed to initialize WebSocket:", err);
+            }
+        };
+
+        connect();
+
+        return () => {
+            stopped = true;
+            clearTimeout(reconnectTimer);
+            ws?.close();
+        };
     }, [serverUrl]);
 
     useEffect(() => {
         activeChannelRef.current = activeChannelId;
         if (activeChannelId) loadMessages(activeChannelId);
-        else setMessages([]);
+        else {
+            setMessages([]);
+            setOlderCursor(null);
+        }
+        setOnlineUserIds(new Set());
+        requestPresence(activeChannelId);
+        if (activeChannelId) scheduleMarkRead(activeChannelId, 0);
     }, [activeChannelId]);
 
+    const updateChannel = (channelId, update) => {
+        setChannels(prev => prev.map(c => c.id === channelId ? { ...c, ...update(c) } : c));
+    };
+
+    const scheduleMarkRead = (channelId, delay = 1000) => {
+        clearTimeout(markReadTimerRef.current);
+        updateChannel(channelId, () => ({ unread_count: 0 }));
+        markReadTimerRef.current = setTimeout(async () => {
+            try {
+                const marker = await markChannelRead(channelId);
+                updateChannel(channelId, () => ({ unread_count: marker.unread_count, last_read_message_id: marker.last_read_message_id }));
+            } catch (err) {
+                console.error(err);
+            }
+        }, delay);
+    };
+
     const loadChannels = async () => {
         try {
             const data = await getChannels();
@@ -98,15 +178,75 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
         }
     };
 
+    // Catches up after being offline with what changed instead of reloading everything
+    const syncChanges = async () => {
+        if (syncVersionRef.current === null || syncingRef.current) return;
+        syncingRef.current = true;
+        try {
+            let changed = false;
+            let page;
+            do {
+                page = await getChanges(syncVersionRef.current);
+                if (page.reset) {
+                    // Older than the server keeps: start over
+                    loadChannels();
+                    if (activeChannelRef.current) loadMessages(activeChannelRef.current);
+                    syncVersionRef.current = page.version;
+                    return;
+                }
+                changed = changed || page.changes.length > 0;
+                page.changes.forEach(change => {
+                    if (change.kind === 'message' && change.op === 'create') {
+                        const message = change.data;
+                        if (message.channel_id === activeChannelRef.current) {
+                            setMessages(prev => prev.some(m => m.id === message.id) ? prev : [...prev, message]);
+                        }
+                    } else if (change.kind === 'message' && change.op === 'delete') {
+                        setMessages(prev => prev.filter(m => m.id !== change.entity_id));
+                    } else if (change.kind === 'channel' && change.op === 'delete') {
+                        setChannels(prev => prev.filter(c => c.id !== change.channel_id));
+                        if (activeChannelRef.current === change.channel_id) setActiveChannelId(null);
+                    }
+                    // New channels and membership changes arrive with the channel list reloaded below
+                });
+                syncVersionRef.current = page.version;
+            } while (page.has_more);
+            // One reload brings new channels, memberships and unread counts up to date
+            if (changed) loadChannels();
+        } catch (err) {
+            console.error(err);
+        } finally {
+            syncingRef.current = false;
+        }
+    };
+
     const loadMessages = async (channelId) => {
         try {
-            const data = await getMessages(channelId);
-            setMessages(data);
+            const page = await getMessages(channelId);
+            if (channelId !== activeChannelRef.current) return;
+            setMessages(page.items);
+            setOlderCursor(page.has_more ? page.next_cursor : null);
         } catch (err) {
             console.error(err);
         }
     };
 
+    const loadOlderMessages = async () => {
+        const channelId = activeChannelRef.current;
+        if (!channelId || !olderCursor || loadingOlderRef.current) return;
+        loadingOlderRef.current = true;
+        try {
+            const page = await getMessages(channelId, { beforeId: olderCursor });
+            if (channelId !== activeChannelRef.current) return;
+            setMessages(prev => [...page.items.filter(m => !prev.some(p => p.id === m.id)), ...prev]);
+            setOlderCursor(page.has_more ? page.next_cursor : null);
+        } catch (err) {
+            console.error(err);
+        } finally {
+            loadingOlderRef.current = false;
+        }
+    };
+
     const loadUsers = async () => {
         try {
             const data = await getUsers();
@@ -116,8 +256,107 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
         }
     };
 
+    // Sends a frame over the open socket; resolves with the server's ack
+    const sendFrame = (frame) => {
+        const ws = wsRef.current;
+        if (!ws || ws.readyState !== WebSocket.OPEN) return null;
+        const tempId = `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        return new Promise((resolve, reject) => {
+            pendingFramesRef.current.set(tempId, { resolve, reject });
+            ws.send(JSON.stringify({ ...frame, temp_id: tempId }));
+        });
+    };
+
+    // Asks who of the channel's members is online; answered with a presence_list frame
+    const requestPresence = (channelId) => {
+        const ws = wsRef.current;
+        if (channelId && ws && ws.readyState === WebSocket.OPEN) {
+            ws.send(JSON.stringify({ type: 'presence', channel_id: channelId }));
+        }
+    };
+
+    const handleTyping = () => {
+        const ws = wsRef.current;
+        const channelId = activeChannelRef.current;
+        if (!channelId || !ws || ws.readyState !== WebSocket.OPEN) return;
+        // The server drops anything more frequent anyway
+        if (Date.now() - lastTypingSentRef.current < 2000) return;
+        lastTypingSentRef.current = Date.now();
+        ws.send(JSON.stringify({ type: 'typing', channel_id: channelId }));
+    };
+
+    const clearTyping = (key) => {
+        setTypingUsers(prev => {
+            if (!prev[key]) return prev;
+            const next = { ...prev };
+            delete next[key];
+            return next;
+        });
+    };
+
     const handleWsMessage = (data) => {
-        if (data.type === 'new_message') {
+        if (data.seq !== undefined) {
+            const channelId = data.type === 'new_message' ? data.message.channel_id : (data.channel_id ?? data.id);
+            // Replayed and live frames can overlap right after a reconnect
+            if (data.seq <= (seqsRef.current[channelId] || 0)) return;
+            seqsRef.current[channelId] = data.seq;
+        }
+
+        if (data.type === 'ping') {
+            // Server heartbeat: silent sockets are reaped
+            wsRef.current?.send(JSON.stringify({ type: 'pong' }));
+        } else if (data.type === 'hello') {
+            helloSeqsRef.current = data.seqs;
+            if (data.epoch !== epochRef.current) {
+                // New server process: old sequence numbers mean nothing (a resync follows if we had any)
+                epochRef.current = data.epoch;
+                seqsRef.current = { ...data.seqs };
+            } else {
+                // Same process: keep our cursors, the replay brings them up to date
+                seqsRef.current = { ...data.seqs, ...seqsRef.current };
+            }
+        } else if (data.type === 'resync') {
+            // The gap is older than the server's buffer: reload from history
+            data.channel_ids.forEach(id => { seqsRef.current[id] = helloSeqsRef.current[id] || 0; });
+            if (data.channel_ids.includes(activeChannelRef.current)) loadMessages(activeChannelRef.current);
+        } else if (data.type === 'ack' || data.type === 'error') {
+            const pending = pendingFramesRef.current.get(data.temp_id);
+            if (!pending) return;
+            pendingFramesRef.current.delete(data.temp_id);
+            if (data.type === 'ack') pending.resolve(data);
+            else pending.reject(new Error(data.detail));
+        } else if (data.type === 'typing') {
+            if (data.user_id === user.id) return;
+            const key = `${data.user_id}:${data.channel_id}`;
+            const expires = Date.now() + data.ttl * 1000;
+            setTypingUsers(prev => ({ ...prev, [key]: { username: data.username, channelId: data.channel_id, expires } }));
+            setTimeout(() => {
+                setTypingUsers(prev => {
+                    // A newer notification pushed the expiry further out
+                    if (!prev[key] || prev[key].expires > Date.now()) return prev;
+                    const next = { ...prev };
+                    delete next[key];
+                    return next;
+                });
+            }, data.ttl * 1000);
+        } else if (data.type === 'presence') {
+            setOnlineUserIds(prev => {
+                const next = new Set(prev);
+                if (data.online) next.add(data.user_id);
+                else next.delete(data.user_id);
+                return next;
+            });
+        } else if (data.type === 'presence_list') {
+            if (data.channel_id === activeChannelRef.current) setOnlineUserIds(new Set(data.user_ids));
+        } else if (data.type === 'new_message') {
+            clearTyping(`${data.message.user_id}:${data.message.channel_id}`);
+            const { id, user_id, username, content, created_at } = data.message;
+            updateChannel(data.message.channel_id, () => ({ last_message: { id, user_id, username, content: (content || '').slice(0, 120), created_at } }));
+            if (data.message.channel_id === activeChannelRef.current) {
+                scheduleMarkRead(data.message.channel_id);
+            } else if (data.message.user_id !== user.id) {
+                updateChannel(data.message.channel_id, c => ({ unread_count: (c.unread_count || 0) + 1 }));
+            }
             setMessages(prev => {
                 if (data.message.channel_id === activeChannelRef.current) {
                     if (prev.find(m => m.id === data.message.id)) return prev;
@@ -127,9 +366,21 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
             });
         } else if (data.type === 'message_deleted') {
             setMessages(prev => prev.filter(m => m.id !== data.id));
+            if (data.channel_id !== activeChannelRef.current) {
+                // Only a message past our marker was counted as unread
+                updateChannel(data.channel_id, c => (c.unread_count > 0 && data.id > (c.last_read_message_id || 0)) ? { unread_count: c.unread_count - 1 } : {});
+            }
+        } else if (data.type === 'channel_read') {
+            // Read on another tab or device
+            updateChannel(data.channel_id, () => ({ unread_count: data.unread_count, last_read_message_id: data.last_read_message_id }));
         } else if (data.type === 'channel_deleted') {
             setChannels(prev => prev.filter(c => c.id !== data.id));
             if (activeChannelId === data.id) setActiveChannelId(null);
+        } else if (data.type === 'channel_added') {
+            loadChannels();
+        } else if (data.type === 'channel_removed') {
+            setChannels(prev => prev.filter(c => c.id !== data.id));
+            if (activeChannelRef.current === data.id) setActiveChannelId(null);
         }
     };
 
@@ -158,7 +409,10 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
     const handleSendMessage = async (content, imageUrl = null, thumbnailUrl = null) => {
         if (!activeChannelId) return;
         try {
-            await sendMessage(activeChannelId, content, imageUrl, thumbnailUrl);
+            const sent = sendFrame({ type: 'send', channel_id: activeChannelId, content, image_url: imageUrl, thumbnail_url: thumbnailUrl });
+            // Fall back to HTTP while the socket is (re)connecting
+            if (sent) await sent;
+            else await sendMessage(activeChannelId, content, imageUrl, thumbnailUrl);
         } catch (err) {
             console.error("Failed to send", err);
         }
@@ -166,9 +420,11 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
 
     const handleDeleteMessage = async (messageId) => {
         try {
-            await deleteMessage(messageId);
+            const sent = sendFrame({ type: 'delete', id: messageId });
+            if (sent) await sent;
+            else await deleteMessage(messageId);
         } catch (err) {
-            showInfo("Ошибка", "Не удалось удалить: " + (err.response?.data?.detail || "Ошибка сервера"));
+            showInfo("Ошибка", "Не удалось удалить: " + (err.response?.data?.detail || err.message || "Ошибка сервера"));
         }
     }
 
@@ -505,31 +761,38 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
 
     const handleManageMembers = (channel) => {
         let usernameToAdd = '';
+        const isOwner = channel.created_by === user.id;
 
-        const refreshModal = (updatedChannel) => {
-            const isOwner = updatedChannel.created_by === user.id;
+        const reload = async () => {
+            // member_count in the channel list changes too
+            loadChannels();
+            const page = await getChannelMembers(channel.id);
+            refreshModal(page.items, page.has_more ? page.next_cursor : null);
+        };
 
+        const refreshModal = (members, nextCursor) => {
             setModal({
                 isOpen: true,
-                title: `Участники канала #${updatedChannel.name}`,
+                title: `Участники канала #${channel.name}`,
                 content: (
                     <div style={{ display: 'flex', flexDirection: 'column', gap: '15px' }}>
                         {isOwner && (
                             <div style={{ display: 'flex', gap: '8px' }}>
                                 <input
                                     type="text"
-                                    placeholder="Имя пользователя..."
+                                    placeholder="Имена пользователей через запятую..."
                                     onChange={e => usernameToAdd = e.target.value}
                                     style={{ flex: 1, padding: '8px' }}
                                 />
                                 <button
                                     onClick={async () => {
                                         try {
-                                            await addChannelMember(updatedChannel.id, usernameToAdd.toLowerCase());
-                                            const updatedData = await getChannels();
-                                            setChannels(updatedData);
-                                            const fresh = updatedData.find(c => c.id === updatedChannel.id);
-                                            refreshModal(fresh);
+                                            const usernames = usernameToAdd.toLowerCase().split(/[\s,]+/).filter(Boolean);
+                                            const result = await addChannelMembers(channel.id, usernames);
+                                            await reload();
+                                            if (result.not_found.length) {
+                                                showInfo("Не найдены", result.not_found.join(', '));
+                                            }
                                         } catch (err) {
                                             showInfo("Ошибка", err.response?.data?.detail || "Не удалось добавить");
                                         }
@@ -541,7 +804,7 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
                             </div>
                         )}
                         <div style={{ maxHeight: '200px', overflowY: 'auto', border: '1px solid var(--border)', borderRadius: '4px' }}>
-                            {updatedChannel.members.map(m => (
+                            {members.map(m => (
                                 <div key={m.id} style={{
                                     display: 'flex',
                                     justifyContent: 'space-between',
@@ -549,16 +812,13 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
                                     borderBottom: '1px solid #f9fafb',
                                     alignItems: 'center'
                                 }}>
-                                    <span>{m.username} {m.id === updatedChannel.created_by && <small>(автор)</small>}</span>
-                                    {isOwner && m.id !== updatedChannel.created_by && (
+                                    <span>{m.username} {m.id === channel.created_by && <small>(автор)</small>}</span>
+                                    {isOwner && m.id !== channel.created_by && (
                                         <button
                                             onClick={async () => {
                                                 try {
-                                                    await removeChannelMember(updatedChannel.id, m.id);
-                                                    const updatedData = await getChannels();
-                                                    setChannels(updatedData);
-                                                    const fresh = updatedData.find(c => c.id === updatedChannel.id);
-                                                    refreshModal(fresh);
+                                                    await removeChannelMember(channel.id, m.id);
+                                                    await reload();
                                                 } catch (err) {
                                                     showInfo("Ошибка", err.response?.data?.detail || "Не удалось удалить");
                                                 }
@@ -570,6 +830,22 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
                                     )}
                                 </div>
                             ))}
+                            {nextCursor && (
+                                <button
+                                    className="btn-secondary"
+                                    onClick={async () => {
+                                        try {
+                                            const page = await getChannelMembers(channel.id, { afterId: nextCursor });
+                                            refreshModal([...members, ...page.items], page.has_more ? page.next_cursor : null);
+                                        } catch (err) {
+                                            showInfo("Ошибка", err.response?.data?.detail || "Не удалось загрузить участников");
+                                        }
+                                    }}
+                                    style={{ width: '100%', fontSize: '0.8rem' }}
+                                >
+                                    Показать еще
+                                </button>
+                            )}
                         </div>
                     </div>
                 ),
@@ -577,7 +853,7 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
             });
         };
 
-        refreshModal(channel);
+        reload().catch(err => showInfo("Ошибка", err.response?.data?.detail || "Не удалось загрузить участников"));
     };
 
     const activeChannel = channels.find(c => c.id === activeChannelId);
@@ -725,6 +1001,11 @@ function Chat({ user, onLogout, serverUrl, onDisconnect }) {
                 onSendMessage={handleSendMessage}
                 onDeleteMessage={handleDeleteMessage}
                 onManageMembers={handleManageMembers}
+                onTyping={handleTyping}
+                onLoadOlder={loadOlderMessages}
+                hasOlder={!!olderCursor}
+                onlineUserIds={onlineUserIds}
+                typingUsernames={Object.values(typingUsers).filter(t => t.channelId === activeChannelId).map(t => t.username)}
                 user={user}
             />
 
@@ -35,8 +35,12 @@ const Lightbox = ({ src, onClose }) => {
     );
 };
 
-function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageMembers, user }) {
+function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageMembers, onTyping, onLoadOlder, hasOlder, onlineUserIds, typingUsernames = [], user }) {
     const messagesEndRef = useRef(null);
+    const scrollRef = useRef(null);
+    // Tells an appended message (scroll to bottom) from a prepended older page (keep position)
+    const lastMessageIdRef = useRef(null);
+    const scrollHeightRef = useRef(0);
     const [lightboxImage, setLightboxImage] = useState(null);
 
     const scrollToBottom = () => {
@@ -54,9 +58,23 @@ function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageM
         }
     };
     useEffect(() => {
-        scrollToBottom();
+        const lastId = messages.length ? messages[messages.length - 1].id : null;
+        const container = scrollRef.current;
+        if (lastId !== lastMessageIdRef.current || !container) {
+            scrollToBottom();
+        } else {
+            // Older page went in above: keep the same messages under the viewport
+            container.scrollTop += container.scrollHeight - scrollHeightRef.current;
+        }
+        lastMessageIdRef.current = lastId;
+        if (container) scrollHeightRef.current = container.scrollHeight;
     }, [messages]);
 
+    const handleScroll = (e) => {
+        scrollHeightRef.current = e.currentTarget.scrollHeight;
+        if (hasOlder && e.currentTarget.scrollTop < 100) onLoadOlder?.();
+    };
+
     if (!channel) {
         return (
             <div style={{
@@ -89,7 +107,14 @@ function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageM
                 alignItems: 'center',
                 background: 'var(--surface)'
             }}>
-                <span># {channel.name}</span>
+                <span>
+                    # {channel.name}
+                    {onlineUserIds && onlineUserIds.size > 0 && (
+                        <span style={{ marginLeft: '8px', fontSize: '0.75rem', fontWeight: '500', color: 'var(--text-secondary)' }}>
+                            {onlineUserIds.size} в сети
+                        </span>
+                    )}
+                </span>
                 <button
                     onClick={() => onManageMembers(channel)}
                     style={{
@@ -109,7 +134,7 @@ function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageM
             </div>
 
             {/* Messages */}
-            <div style={{
+            <div ref={scrollRef} onScroll={handleScroll} style={{
                 flex: 1,
                 overflowY: 'auto',
                 padding: '1rem',
@@ -138,6 +163,9 @@ function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageM
                                     <span style={{ fontWeight: '600' }}>
                                         {msg.username || `User ${msg.user_id}`}
                                     </span>
+                                    {onlineUserIds?.has(msg.user_id) && (
+                                        <span title="В сети" style={{ width: '6px', height: '6px', borderRadius: '50%', background: 'var(--success)' }} />
+                                    )}
                                     {canDelete && (
                                         <button
                                             onClick={() => onDeleteMessage(msg.id)}
@@ -208,7 +236,11 @@ function ChatArea({ channel, messages, onSendMessage, onDeleteMessage, onManageM
 
             <div style={{ display: 'flex', justifyContent: 'center', background: 'var(--surface)', borderTop: '1px solid var(--border)' }}>
                 <div style={{ width: '100%', maxWidth: '900px' }}>
-                    <MessageInput onSendMessage={onSendMessage} />
+                    <div style={{ height: '1.2rem', padding: '0 1rem', fontSize: '0.75rem', color: 'var(--text-secondary)' }}>
+                        {typingUsernames.length === 1 && `${typingUsernames[0]} печатает...`}
+                        {typingUsernames.length > 1 && `${typingUsernames.slice(0, 3).join(', ')} печатают...`}
+                    </div>
+                    <MessageInput onSendMessage={onSendMessage} onTyping={onTyping} />
                 </div>
             </div>
 
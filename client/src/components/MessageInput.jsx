@@ -1,7 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { uploadFile } from '../api';
 
-function MessageInput({ onSendMessage, disabled }) {
+function MessageInput({ onSendMessage, onTyping, disabled }) {
     const [content, setContent] = useState('');
     const [selectedImage, setSelectedImage] = useState(null);
     const [previewUrl, setPreviewUrl] = useState(null);
@@ -129,7 +129,10 @@ function MessageInput({ onSendMessage, disabled }) {
                     <input
                         type="text"
                         value={content}
-                        onChange={(e) => setContent(e.target.value)}
+                        onChange={(e) => {
+                            setContent(e.target.value);
+                            if (e.target.value) onTyping?.();
+                        }}
                         onPaste={handlePaste}
                         placeholder="Напишите сообщение..."
                         disabled={disabled || isUploading}
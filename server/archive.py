@@ -0,0 +1,291 @@
+"""Cold storage for old messages.
+
+The archival job moves a channel's oldest messages out of the messages
+table into append-only segment files:
+
+    ARCHIVE_DIR/channel_<id>/<first_id>-<last_id>.seg
+
+A segment is a run of zlib-compressed blocks (a JSON array of messages
+each, ascending id) followed by an index of (first_id, last_id, offset,
+length, count) per block and a fixed footer. Readers mmap the file and
+decompress only the blocks a page needs. The archive_segments table is
+the source of truth: a segment file without its row is ignored.
+
+Everything up to a channel's newest archived id is cold, everything
+after it is hot, so history pages just continue from one into the other.
+
+    python archive.py                      # every channel, ARCHIVE_AFTER_DAYS / ARCHIVE_CHANNEL_DAYS
+    python archive.py --channel 5 --days 30
+"""
+import argparse
+import bisect
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterable, Iterator, List, Optional
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from connection_manager import parse_channel_overrides
+from models import ArchiveSegment, Channel, Message
+import json_codec
+
+logger = logging.getLogger("archive")
+
+# Where segment files live; /data is the server's persistent volume in docker-compose
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "/data/archive" if os.path.isdir("/data") else "data/archive")
+# Messages older than this many days are archived; 0 leaves channels alone unless overridden
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+# Per-channel ages, e.g. "1=365,42=30"
+ARCHIVE_CHANNEL_DAYS = os.getenv("ARCHIVE_CHANNEL_DAYS", "")
+# Messages per compressed block: the unit a cold page read has to inflate
+BLOCK_MESSAGES = 200
+SEGMENT_MAX_MESSAGES = 50_000
+# Open (mmapped) segments kept per worker
+OPEN_SEGMENTS = 64
+
+BLOCK_ENTRY = struct.Struct("<qqQII")
+FOOTER = struct.Struct("<QI8s")
+MAGIC = b"MSGSEG01"
+
+
+def write_segment(path: str, messages: List[dict]):
+    """Writes messages (ascending id) as a segment file, atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    index = []
+    with open(tmp_path, "wb") as f:
+        for start in range(0, len(messages), BLOCK_MESSAGES):
+            block = messages[start:start + BLOCK_MESSAGES]
+            data = zlib.compress(json_codec.dumps(block).encode("utf-8"), 6)
+            index.append(BLOCK_ENTRY.pack(block[0]["id"], block[-1]["id"], f.tell(), len(data), len(block)))
+            f.write(data)
+        index_offset = f.tell()
+        f.write(b"".join(index))
+        f.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """A memory-mapped segment file with its block index."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, count, magic = FOOTER.unpack_from(self.map, len(self.map) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"Not a message segment: {path}")
+        self.blocks = [BLOCK_ENTRY.unpack_from(self.map, index_offset + i * BLOCK_ENTRY.size) for i in range(count)]
+        self.first_ids = [block[0] for block in self.blocks]
+        self.last_ids = [block[1] for block in self.blocks]
+
+    def block(self, i: int) -> List[dict]:
+        _, _, offset, length, _ = self.blocks[i]
+        return json_codec.loads(zlib.decompress(self.map[offset:offset + length]))
+
+    def before(self, before_id: Optional[int], count: int) -> List[dict]:
+        """Up to count messages with id < before_id, newest first."""
+        i = len(self.blocks) - 1 if before_id is None else bisect.bisect_left(self.first_ids, before_id) - 1
+        found = []
+        while i >= 0 and len(found) < count:
+            found.extend(m for m in reversed(self.block(i)) if before_id is None or m["id"] < before_id)
+            i -= 1
+        return found[:count]
+
+    def after(self, after_id: int, count: int) -> List[dict]:
+        """Up to count messages with id > after_id, oldest first."""
+        i = bisect.bisect_right(self.last_ids, after_id)
+        found = []
+        while i < len(self.blocks) and len(found) < count:
+            found.extend(m for m in self.block(i) if m["id"] > after_id)
+            i += 1
+        return found[:count]
+
+    def find(self, ids: Iterable[int]) -> List[dict]:
+        """The messages with these ids, oldest first; each block holding one is inflated once."""
+        wanted = set(ids)
+        blocks = sorted({bisect.bisect_left(self.last_ids, message_id) for message_id in wanted} - {len(self.blocks)})
+        return [m for i in blocks for m in self.block(i) if m["id"] in wanted]
+
+    def count_after(self, after_id: int) -> int:
+        """How many messages have id > after_id; only the block holding after_id is inflated."""
+        i = bisect.bisect_right(self.last_ids, after_id)
+        if i == len(self.blocks):
+            return 0
+        later = sum(block[4] for block in self.blocks[i + 1:])
+        if self.first_ids[i] > after_id:
+            return later + self.blocks[i][4]
+        return later + sum(1 for m in self.block(i) if m["id"] > after_id)
+
+    def __iter__(self) -> Iterator[dict]:
+        # One block inflated at a time, so a whole segment never sits in memory
+        for i in range(len(self.blocks)):
+            yield from self.block(i)
+
+    def close(self):
+        self.map.close()
+
+
+class ColdStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._open: "OrderedDict[str, Segment]" = OrderedDict()
+        # Requests read from the threadpool
+        self._lock = threading.Lock()
+
+    def segment(self, path: str) -> Segment:
+        with self._lock:
+            segment = self._open.get(path)
+            if segment is None:
+                segment = self._open[path] = Segment(os.path.join(self.root, path))
+                if len(self._open) > OPEN_SEGMENTS:
+                    # Not closed: another request may still be reading it; the map goes with its last reference
+                    self._open.popitem(last=False)
+            self._open.move_to_end(path)
+            return segment
+
+    def boundary(self, db: Session, channel_id: int) -> int:
+        """The newest archived id of the channel (0 when nothing is archived)."""
+        return db.query(func.max(ArchiveSegment.last_id)).filter(ArchiveSegment.channel_id == channel_id).scalar() or 0
+
+    def read_before(self, db: Session, channel_id: int, before_id: Optional[int], count: int) -> List[dict]:
+        """Cold messages with id < before_id, newest first."""
+        query = db.query(ArchiveSegment.path).filter(ArchiveSegment.channel_id == channel_id)
+        if before_id is not None:
+            query = query.filter(ArchiveSegment.first_id < before_id)
+        found = []
+        for (path,) in query.order_by(ArchiveSegment.last_id.desc()):
+            found.extend(self.segment(path).before(before_id, count - len(found)))
+            if len(found) >= count:
+                break
+        return found
+
+    def read_after(self, db: Session, channel_id: int, after_id: int, count: int) -> List[dict]:
+        """Cold messages with id > after_id, oldest first."""
+        query = db.query(ArchiveSegment.path).filter(
+            ArchiveSegment.channel_id == channel_id, ArchiveSegment.last_id > after_id
+        )
+        found = []
+        for (path,) in query.order_by(ArchiveSegment.first_id.asc()):
+            found.extend(self.segment(path).after(after_id, count - len(found)))
+            if len(found) >= count:
+                break
+        return found
+
+    def find(self, db: Session, channel_id: int, message_ids: List[int]) -> List[dict]:
+        """The archived messages of the channel among message_ids, oldest first."""
+        if not message_ids:
+            return []
+        segments = db.query(ArchiveSegment.path, ArchiveSegment.first_id, ArchiveSegment.last_id).filter(
+            ArchiveSegment.channel_id == channel_id,
+            ArchiveSegment.first_id <= max(message_ids),
+            ArchiveSegment.last_id >= min(message_ids),
+        ).order_by(ArchiveSegment.first_id.asc())
+        found = []
+        for path, first_id, last_id in segments:
+            ids = [message_id for message_id in message_ids if first_id <= message_id <= last_id]
+            if ids:
+                found.extend(self.segment(path).find(ids))
+        return found
+
+    def count_after(self, db: Session, channel_id: int, after_id: int) -> int:
+        """Archived messages of the channel with id > after_id: whole segments from their row, a partial one from its index."""
+        segments = db.query(ArchiveSegment.path, ArchiveSegment.first_id, ArchiveSegment.message_count).filter(
+            ArchiveSegment.channel_id == channel_id, ArchiveSegment.last_id > after_id
+        )
+        return sum(
+            message_count if first_id > after_id else self.segment(path).count_after(after_id)
+            for path, first_id, message_count in segments
+        )
+
+    def iter_channel(self, db: Session, channel_id: int) -> Iterator[dict]:
+        """Every archived message of the channel, oldest first."""
+        paths = [path for (path,) in db.query(ArchiveSegment.path).filter(
+            ArchiveSegment.channel_id == channel_id
+        ).order_by(ArchiveSegment.first_id.asc())]
+        for path in paths:
+            yield from self.segment(path)
+
+    def archive_channel(self, db: Session, channel_id: int, older_than: datetime) -> int:
+        """Moves every message up to the newest one created before older_than into segments."""
+        from routers.chat import query_message_rows
+
+        last_id = db.query(func.max(Message.id)).filter(
+            Message.channel_id == channel_id, Message.created_at < older_than
+        ).scalar()
+        if last_id is None:
+            return 0
+        archived = 0
+        while True:
+            rows = query_message_rows(db).filter(
+                Message.channel_id == channel_id, Message.id <= last_id
+            ).order_by(Message.id.asc()).limit(SEGMENT_MAX_MESSAGES).all()
+            if not rows:
+                return archived
+            messages = [{**row._asdict(), "created_at": row.created_at.isoformat()} for row in rows]
+            first, last = messages[0]["id"], messages[-1]["id"]
+            path = os.path.join(f"channel_{channel_id}", f"{first:012d}-{last:012d}.seg")
+            write_segment(os.path.join(self.root, path), messages)
+            # Segment row and delete commit together; a crash before this leaves only an unused file
+            db.add(ArchiveSegment(channel_id=channel_id, first_id=first, last_id=last, message_count=len(messages), path=path))
+            db.query(Message).filter(
+                Message.channel_id == channel_id, Message.id >= first, Message.id <= last
+            ).delete(synchronize_session=False)
+            db.commit()
+            archived += len(messages)
+            logger.info("Archived %d messages of channel %s (ids %d-%d)", len(messages), channel_id, first, last)
+
+    def drop_channel(self, db: Session, channel_id: int):
+        """Removes a deleted channel's segments; the files go once the caller commits."""
+        paths = [path for (path,) in db.query(ArchiveSegment.path).filter(ArchiveSegment.channel_id == channel_id)]
+        db.query(ArchiveSegment).filter(ArchiveSegment.channel_id == channel_id).delete(synchronize_session=False)
+        if paths:
+            event.listen(db, "after_commit", lambda session: self._remove_files(paths), once=True)
+
+    def _remove_files(self, paths: List[str]):
+        for path in paths:
+            with self._lock:
+                # Unmapped once no reader holds it; the file can go before that
+                self._open.pop(path, None)
+            try:
+                os.remove(os.path.join(self.root, path))
+            except FileNotFoundError:
+                pass
+
+
+cold_store = ColdStore(ARCHIVE_DIR)
+
+
+def run_archival(db: Session, default_days: float = ARCHIVE_AFTER_DAYS, channel_days: Optional[dict] = None) -> int:
+    channel_days = parse_channel_overrides(ARCHIVE_CHANNEL_DAYS, "ARCHIVE_CHANNEL_DAYS") if channel_days is None else channel_days
+    now = datetime.utcnow()
+    archived = 0
+    for (channel_id,) in db.query(Channel.id).all():
+        days = channel_days.get(channel_id, default_days)
+        if days > 0:
+            archived += cold_store.archive_channel(db, channel_id, now - timedelta(days=days))
+    return archived
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Move old messages into compressed archive segments")
+    parser.add_argument("--channel", type=int, help="only this channel")
+    parser.add_argument("--days", type=float, help="archive messages older than this many days")
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        if args.channel is not None:
+            if args.days is None:
+                parser.error("--channel needs --days")
+            total = cold_store.archive_channel(db, args.channel, datetime.utcnow() - timedelta(days=args.days))
+        else:
+            total = run_archival(db, args.days if args.days is not None else ARCHIVE_AFTER_DAYS)
+    print(f"Archived {total} messages")
@@ -0,0 +1,109 @@
+"""Micro-benchmark: CPU cost of one channel broadcast against the number of sockets.
+
+Compares the old path (send_json on every socket, i.e. one JSON encode per
+recipient) with the current one (encode once, same text frame for everyone).
+
+    python bench_broadcast.py [sockets ...]
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import json_codec
+from connection_manager import ConnectionManager, SEND_TIMEOUT
+from event_bus import InProcessEventBus
+
+ROUNDS = 20
+
+MESSAGE = {
+    "type": "new_message",
+    "message": {
+        "id": 123456,
+        "channel_id": 1,
+        "user_id": 42,
+        "content": "Привет всем! Сегодня в 15:00 созвон по релизу, ссылка в описании канала. " * 4,
+        "image_url": "/uploads/0b6f3c3e-8d53-4a57-9a2b-0c1f1f4a1f5e.jpg",
+        "thumbnail_url": "/uploads/thumb_0b6f3c3e-8d53-4a57-9a2b-0c1f1f4a1f5e.jpg",
+        "username": "ivan.petrov",
+        "created_at": "2026-01-15T12:34:56.789012",
+    },
+}
+
+
+class NullWebSocket:
+    """Accepts frames without doing I/O, so only encoding and queueing are measured."""
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, data):
+        pass
+
+    async def send_json(self, data):
+        # What starlette's WebSocket.send_json does before sending
+        json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+    async def close(self, code=1000):
+        pass
+
+
+class BenchUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.username = f"user{user_id}"
+        self.is_admin = False
+
+
+class PerSocketEncodeManager(ConnectionManager):
+    """The previous behaviour: queue the dict, encode it again for every socket."""
+
+    def _channel_event(self, channel_id, message):
+        self._enqueue(self.channel_subscribers.get(channel_id, set()) | self.admin_connections, [message])
+
+    def _fan_out(self, connections, message, ephemeral=False):
+        self._enqueue(connections, [message], ephemeral)
+
+    async def _send(self, connection, message):
+        async with asyncio.timeout(SEND_TIMEOUT):
+            await connection.websocket.send_json(message)
+
+
+async def bench(manager_class, sockets):
+    manager = manager_class(InProcessEventBus())
+    await manager.start()
+    for user_id in range(sockets):
+        await manager.connect(NullWebSocket(), BenchUser(user_id), [1])
+    # Let hello and presence frames from connecting drain before measuring
+    while any(connection.queue.qsize() for connection in manager.active_connections):
+        await asyncio.sleep(0)
+    start = time.process_time()
+    for _ in range(ROUNDS):
+        target = manager.stats["sent"] + sockets
+        manager.broadcast_to_channel(1, MESSAGE)
+        while manager.stats["sent"] < target:
+            await asyncio.sleep(0)
+    elapsed = (time.process_time() - start) / ROUNDS
+    writers = [connection.writer for connection in manager.active_connections]
+    for connection in list(manager.active_connections):
+        manager.disconnect(connection)
+    await asyncio.gather(*writers, return_exceptions=True)
+    return elapsed
+
+
+async def main(sizes):
+    encoder = "orjson" if json_codec.orjson is not None else "json (stdlib)"
+    print(f"Encoder: {encoder}, {ROUNDS} broadcasts per size")
+    print(f"{'sockets':>8} {'per-socket encode':>18} {'encode once':>12} {'speedup':>8}")
+    for sockets in sizes:
+        legacy = await bench(PerSocketEncodeManager, sockets)
+        current = await bench(ConnectionManager, sockets)
+        print(f"{sockets:>8} {legacy * 1000:>15.2f} ms {current * 1000:>9.2f} ms {legacy / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    asyncio.run(main(sizes))
@@ -0,0 +1,305 @@
+"""Bulk import of users, channels, memberships and messages from NDJSON.
+
+Reads the line format GET /admin/export writes ({"type": "user" | "channel"
+| "member" | "message", ...}), in that order: a record can only refer to
+users and channels that came before it. Ids in the file are the old
+system's; they are mapped to the ids rows get here. Users and channels
+whose name already exists are merged into the existing row.
+
+Messages go in large batches without the per-message path (no commit,
+refresh or WebSocket broadcast each): executemany on SQLite, COPY on
+PostgreSQL. Every batch commits on its own, so an interrupted import keeps
+what it has written so far. Imported messages are history, not news: they
+stay out of the sync change log (channels and memberships do not) and
+arrive already read for members who were caught up.
+
+    python bulk_import.py dump.ndjson
+    python bulk_import.py dump.ndjson.gz
+"""
+import argparse
+import gzip
+import io
+import logging
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from models import Channel, Message, User, channel_members
+from read_markers import add_history_counts, mark_members_read
+from change_log import log_changes
+import json_codec
+
+logger = logging.getLogger("bulk_import")
+
+# Rows per INSERT / COPY batch (and per transaction)
+IMPORT_BATCH_ROWS = 10_000
+# A progress line is logged every this many messages
+IMPORT_PROGRESS_ROWS = 100_000
+
+DEFAULT_CHANNEL = "Общий"
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+MESSAGE_COLUMNS = ["channel_id", "user_id", "content", "image_url", "thumbnail_url", "created_at"]
+# Fields a record cannot be written without, and their types; other fields are optional
+REQUIRED_FIELDS = {
+    "user": {"id": int, "username": str},
+    "channel": {"id": int, "name": str},
+    "member": {"channel_id": int, "user_id": int},
+    "message": {"channel_id": int, "user_id": int},
+}
+
+
+def insert_ignore(table, dialect_name: str):
+    """INSERT that skips rows already present (ON CONFLICT DO NOTHING on both dialects)."""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    return dialect.insert(table).on_conflict_do_nothing()
+
+
+def copy_value(value) -> str:
+    """A field in COPY's text format, where \\N is NULL."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).translate(COPY_ESCAPES)
+
+
+def has_required_fields(record: dict) -> bool:
+    fields = REQUIRED_FIELDS.get(record.get("type"))
+    return fields is not None and all(isinstance(record.get(name), kind) for name, kind in fields.items())
+
+
+def parse_datetime(value: Optional[str]) -> datetime:
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+class BulkImporter:
+    def __init__(self, engine: Engine, owner_id: Optional[int] = None, batch_rows: int = IMPORT_BATCH_ROWS):
+        self.engine = engine
+        # Channels whose creator is not in the file are given to this user (skipped when None)
+        self.owner_id = owner_id
+        self.postgres = engine.dialect.name == "postgresql"
+        self.batch_rows = batch_rows
+        self.user_ids: Dict[int, int] = {}
+        self.channel_ids: Dict[int, int] = {}
+        self._type: Optional[str] = None
+        self._buffer: List[dict] = []
+        self._password_hash: Optional[str] = None
+        self.started = time.perf_counter()
+        self.stats = {"users": 0, "channels": 0, "members": 0, "messages": 0, "merged": 0, "skipped": 0}
+
+    def feed_line(self, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json_codec.loads(line)
+        except ValueError:
+            self.stats["skipped"] += 1
+            return
+        if not isinstance(record, dict):
+            self.stats["skipped"] += 1
+            return
+        self.feed(record)
+
+    def feed(self, record: dict):
+        if not has_required_fields(record):
+            self.stats["skipped"] += 1
+            return
+        # Records of one type are buffered together; a new type means the previous one is complete
+        if record["type"] != self._type:
+            self.flush()
+            self._type = record["type"]
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            batch, self._buffer = self._buffer, []
+            with self.engine.begin() as conn:
+                self._writers[self._type](self, conn, batch)
+
+    def finish(self) -> dict:
+        self.flush()
+        seconds = time.perf_counter() - self.started
+        return {
+            **self.stats,
+            "seconds": round(seconds, 2),
+            "messages_per_second": round(self.stats["messages"] / seconds) if seconds else 0,
+        }
+
+    def _write_users(self, conn: Connection, batch: List[dict]):
+        names = [record.get("username") for record in batch]
+        existing = dict(conn.execute(select(User.username, User.id).where(User.username.in_(names))).all())
+        emails = [record["email"] for record in batch if record.get("email")]
+        taken_emails = set(conn.execute(select(User.email).where(User.email.in_(emails))).scalars()) if emails else set()
+
+        rows, external_ids = [], []
+        for record in batch:
+            username = record.get("username")
+            if not username:
+                self.stats["skipped"] += 1
+            elif username in existing:
+                self._merge(self.user_ids, record["id"], existing[username])
+            else:
+                email = record.get("email")
+                if email in taken_emails:
+                    email = None
+                taken_emails.add(email)
+                existing[username] = None  # a repeat later in the batch is skipped
+                rows.append({
+                    "username": username,
+                    "email": email,
+                    "password_hash": record.get("password_hash") or self._imported_password_hash(),
+                    "is_admin": bool(record.get("is_admin")),
+                    "created_at": parse_datetime(record.get("created_at")),
+                })
+                external_ids.append(record["id"])
+        if not rows:
+            return
+        statement = insert(User).returning(User.id, sort_by_parameter_order=True)
+        new_ids = conn.execute(statement, rows).scalars().all()
+        self.user_ids.update(zip(external_ids, new_ids))
+        self.stats["users"] += len(new_ids)
+
+        # Same as a user created by an admin: everyone is in the default channel
+        default_channel = conn.execute(select(Channel.id).where(Channel.name == DEFAULT_CHANNEL)).scalar()
+        if default_channel is not None:
+            conn.execute(insert_ignore(channel_members, self.engine.dialect.name),
+                         [{"channel_id": default_channel, "user_id": user_id} for user_id in new_ids])
+            log_changes(conn, "member", "create", [(default_channel, user_id) for user_id in new_ids])
+            mark_members_read(conn, default_channel, new_ids)
+
+    def _merge(self, id_map: Dict[int, int], external_id: int, existing_id: Optional[int]):
+        if existing_id is None:
+            self.stats["skipped"] += 1
+        else:
+            id_map[external_id] = existing_id
+            self.stats["merged"] += 1
+
+    def _imported_password_hash(self) -> str:
+        # Exports carry no password hashes; bcrypt per user would dominate the import, so all
+        # such users share the hash of one random throwaway secret until an admin resets it
+        if self._password_hash is None:
+            from auth_dependencies import get_password_hash
+            self._password_hash = get_password_hash(secrets.token_urlsafe(32))
+        return self._password_hash
+
+    def _write_channels(self, conn: Connection, batch: List[dict]):
+        names = [record.get("name") for record in batch]
+        existing = dict(conn.execute(select(Channel.name, Channel.id).where(Channel.name.in_(names))).all())
+        rows, external_ids = [], []
+        for record in batch:
+            name = record.get("name")
+            created_by = self.user_ids.get(record.get("created_by"), self.owner_id)
+            if not name or created_by is None:
+                self.stats["skipped"] += 1
+            elif name in existing:
+                self._merge(self.channel_ids, record["id"], existing[name])
+            else:
+                existing[name] = None  # a repeat later in the batch is skipped
+                rows.append({
+                    "name": name,
+                    "created_by": created_by,
+                    "created_at": parse_datetime(record.get("created_at")),
+                })
+                external_ids.append(record["id"])
+        if rows:
+            statement = insert(Channel).returning(Channel.id, sort_by_parameter_order=True)
+            new_ids = conn.execute(statement, rows).scalars().all()
+            self.channel_ids.update(zip(external_ids, new_ids))
+            self.stats["channels"] += len(new_ids)
+            log_changes(conn, "channel", "create", [(channel_id, None) for channel_id in new_ids])
+
+    def _write_members(self, conn: Connection, batch: List[dict]):
+        rows = []
+        for record in batch:
+            channel_id = self.channel_ids.get(record.get("channel_id"))
+            user_id = self.user_ids.get(record.get("user_id"))
+            if channel_id is None or user_id is None:
+                self.stats["skipped"] += 1
+            else:
+                rows.append({"channel_id": channel_id, "user_id": user_id})
+        if rows:
+            # Pairs that already existed come back from neither RETURNING nor the change log
+            statement = insert_ignore(channel_members, self.engine.dialect.name).returning(channel_members.c.channel_id, channel_members.c.user_id)
+            inserted = conn.execute(statement, rows).all()
+            self.stats["members"] += len(inserted)
+            log_changes(conn, "member", "create", [(row.channel_id, row.user_id) for row in inserted])
+            joined = {}
+            for row in inserted:
+                joined.setdefault(row.channel_id, []).append(row.user_id)
+            for channel_id, user_ids in joined.items():
+                mark_members_read(conn, channel_id, user_ids)
+
+    def _write_messages(self, conn: Connection, batch: List[dict]):
+        rows = []
+        for record in batch:
+            channel_id = self.channel_ids.get(record.get("channel_id"))
+            user_id = self.user_ids.get(record.get("user_id"))
+            if channel_id is None or user_id is None:
+                self.stats["skipped"] += 1
+                continue
+            rows.append({
+                "channel_id": channel_id,
+                "user_id": user_id,
+                "content": record.get("content"),
+                "image_url": record.get("image_url"),
+                "thumbnail_url": record.get("thumbnail_url"),
+                "created_at": parse_datetime(record.get("created_at")),
+            })
+        if not rows:
+            return
+        if self.postgres:
+            self._copy_messages(conn, rows)
+        else:
+            # No RETURNING, so this is a plain executemany of one prepared statement
+            conn.execute(insert(Message), rows)
+        add_history_counts(conn, [row["channel_id"] for row in rows])
+
+        before = self.stats["messages"]
+        self.stats["messages"] += len(rows)
+        if before // IMPORT_PROGRESS_ROWS != self.stats["messages"] // IMPORT_PROGRESS_ROWS:
+            seconds = time.perf_counter() - self.started
+            logger.info("Imported %d messages (%.0f msg/s)", self.stats["messages"], self.stats["messages"] / seconds)
+
+    def _copy_messages(self, conn: Connection, rows: List[dict]):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(copy_value(row[column]) for column in MESSAGE_COLUMNS))
+            buffer.write("\n")
+        buffer.seek(0)
+        cursor = conn.connection.driver_connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY messages ({', '.join(MESSAGE_COLUMNS)}) FROM STDIN", buffer)
+        finally:
+            cursor.close()
+
+    _writers = {
+        "user": _write_users,
+        "channel": _write_channels,
+        "member": _write_members,
+        "message": _write_messages,
+    }
+
+
+if __name__ == "__main__":
+    from database import Base, engine
+    from migrate import run_migrations
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Import users, channels and messages from an NDJSON export")
+    parser.add_argument("path", help="NDJSON file, optionally gzipped (.gz)")
+    args = parser.parse_args()
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    with engine.connect() as conn:
+        owner_id = conn.execute(select(User.id).where(User.username == "admin")).scalar()
+    importer = BulkImporter(engine, owner_id)
+    with (gzip.open if args.path.endswith(".gz") else open)(args.path, "rb") as f:
+        for line in f:
+            importer.feed_line(line)
+    print(importer.finish())
@@ -0,0 +1,103 @@
+"""Change log behind GET /sync.
+
+Every message, channel and membership create or delete appends a row in
+the same transaction as the change itself; deletes are tombstones. Each
+row gets a global version, so a client that was offline asks for the
+rows after the last version it saw and gets work proportional to what
+changed, not to how much history there is.
+
+Versions follow commit order, so a change can never turn up behind a
+version a client has already moved past. SQLite has one writer at a
+time, so a row's id already is in commit order and becomes its version
+right away. PostgreSQL commits concurrent transactions in any order:
+rows are written without a version, and assign_versions numbers the
+committed ones, one caller at a time, before every read.
+
+Old rows are pruned by age. A client whose version is older than the
+pruned range is told to reload from scratch.
+
+    python change_log.py --prune              # CHANGE_LOG_DAYS
+    python change_log.py --prune --days 7
+"""
+import argparse
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Tuple
+from sqlalchemy import func, insert, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from models import ChangeLog, SystemSetting
+
+# Days of changes kept for offline clients; keep it below ARCHIVE_AFTER_DAYS so logged messages are still hot
+CHANGE_LOG_DAYS = float(os.getenv("CHANGE_LOG_DAYS", "30"))
+# SystemSetting holding the newest version that has been pruned
+PRUNED_SETTING = "change_log_pruned_through"
+# Arbitrary key for pg_advisory_xact_lock: one assign_versions at a time
+PG_VERSION_LOCK_KEY = 727_100_021
+
+
+def log_changes(conn: Connection, kind: str, op: str, entries: Iterable[Tuple[int, Optional[int]]]):
+    """Appends (channel_id, entity_id) changes of one kind, in the caller's transaction."""
+    rows = [{"kind": kind, "op": op, "channel_id": channel_id, "entity_id": entity_id} for channel_id, entity_id in entries]
+    if rows:
+        conn.execute(insert(ChangeLog), rows)
+        if conn.dialect.name == "sqlite":
+            # The only writer: every unversioned row is this transaction's own
+            conn.execute(text("UPDATE change_log SET version = id WHERE version IS NULL"))
+
+
+def assign_versions(db: Session):
+    """PostgreSQL: versions for the rows committed since the last call, then commits.
+
+    A row committed later only ever gets a larger version than any handed
+    out here, so readers that call this first never skip one.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PG_VERSION_LOCK_KEY})
+    db.execute(text(
+        "UPDATE change_log SET version = numbered.version FROM ("
+        "SELECT id, nextval('change_log_version_seq') AS version FROM ("
+        "SELECT id FROM change_log WHERE version IS NULL ORDER BY id) pending) numbered "
+        "WHERE change_log.id = numbered.id"
+    ))
+    db.commit()
+
+
+def current_version(db: Session) -> int:
+    return db.query(func.max(ChangeLog.version)).scalar() or 0
+
+
+def pruned_through(db: Session) -> int:
+    setting = db.get(SystemSetting, PRUNED_SETTING)
+    return int(setting.value) if setting and setting.value else 0
+
+
+def prune(db: Session, older_than: datetime) -> int:
+    """Deletes the changes made before older_than and remembers how far that went."""
+    assign_versions(db)
+    last = db.query(func.max(ChangeLog.version)).filter(ChangeLog.created_at < older_than).scalar()
+    if last is None:
+        return 0
+    deleted = db.query(ChangeLog).filter(ChangeLog.version <= last).delete(synchronize_session=False)
+    setting = db.get(SystemSetting, PRUNED_SETTING)
+    if setting is None:
+        db.add(SystemSetting(key=PRUNED_SETTING, value=str(last)))
+    else:
+        setting.value = str(max(last, int(setting.value or 0)))
+    db.commit()
+    return deleted
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Maintain the delta-sync change log")
+    parser.add_argument("--prune", action="store_true", help="delete old changes")
+    parser.add_argument("--days", type=float, default=CHANGE_LOG_DAYS, help="keep this many days of changes")
+    args = parser.parse_args()
+    if not args.prune:
+        parser.error("nothing to do (use --prune)")
+    with SessionLocal() as db:
+        total = prune(db, datetime.utcnow() - timedelta(days=args.days))
+    print(f"Pruned {total} changes")
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+from connection_manager import manager
+from models import Channel, User, channel_members
+
+# (user, channel) decisions kept per worker; 0 turns the cache off
+ACL_CACHE_SIZE = int(os.getenv("ACL_CACHE_SIZE", "100000"))
+# Seconds a decision is trusted; the bus invalidates sooner, this bounds anything it cannot see
+ACL_CACHE_TTL = float(os.getenv("ACL_CACHE_TTL", "60"))
+
+Key = Tuple[int, int]
+
+
+class ChannelAccessCache:
+    """Bounded LRU of (user_id, channel_id) -> is a member, with a TTL.
+
+    subscribe / unsubscribe / members / drop_channel / drop_user / refresh_user events from the bus
+    invalidate it on every worker. A lookup that raced with one of them is
+    not stored (generation counters, as in RecentMessagesCache).
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (allowed, expires_at)
+        self.entries: "OrderedDict[Key, Tuple[bool, float]]" = OrderedDict()
+        self.channel_generations: Dict[int, int] = {}
+        self.user_generations: Dict[int, int] = {}
+        # Bumped by invalidate_access, which makes every lookup in flight stale
+        self.epoch = 0
+        # Requests check from the threadpool, events arrive on the event loop
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "stale_fills": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, user_id: int, channel_id: int) -> Optional[bool]:
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get((user_id, channel_id))
+            if entry is None or entry[1] < time.monotonic():
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end((user_id, channel_id))
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def generation(self, user_id: int, channel_id: int) -> tuple:
+        """Taken before the database lookup and handed back to put()."""
+        with self.lock:
+            return self.epoch, self.user_generations.get(user_id, 0), self.channel_generations.get(channel_id, 0)
+
+    def put(self, user_id: int, channel_id: int, allowed: bool, generation: tuple):
+        if not self.enabled:
+            return
+        with self.lock:
+            if generation != (self.epoch, self.user_generations.get(user_id, 0), self.channel_generations.get(channel_id, 0)):
+                self.stats["stale_fills"] += 1
+                return
+            self.entries[(user_id, channel_id)] = (allowed, time.monotonic() + self.ttl)
+            self.entries.move_to_end((user_id, channel_id))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def apply_event(self, event: dict):
+        op = event["op"]
+        with self.lock:
+            if op in ("subscribe", "unsubscribe"):
+                self.user_generations[event["user_id"]] = self.user_generations.get(event["user_id"], 0) + 1
+                self.entries.pop((event["user_id"], event["channel_id"]), None)
+            elif op == "members":
+                for user_id in event["added"] + event["removed"]:
+                    self.user_generations[user_id] = self.user_generations.get(user_id, 0) + 1
+                    self.entries.pop((user_id, event["channel_id"]), None)
+            elif op == "drop_channel":
+                self.channel_generations[event["channel_id"]] = self.channel_generations.get(event["channel_id"], 0) + 1
+                # A deleted channel's ids can come back (SQLite reuses them), so its entries go now
+                for key in [key for key in self.entries if key[1] == event["channel_id"]]:
+                    del self.entries[key]
+            elif op in ("drop_user", "refresh_user"):
+                self.user_generations[event["user_id"]] = self.user_generations.get(event["user_id"], 0) + 1
+                for key in [key for key in self.entries if key[0] == event["user_id"]]:
+                    del self.entries[key]
+            elif op == "invalidate_access":
+                self.epoch += 1
+                self.entries.clear()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                **self.stats,
+            }
+
+
+channel_access = ChannelAccessCache(ACL_CACHE_SIZE, ACL_CACHE_TTL)
+manager.add_listener(channel_access.apply_event)
+
+
+def is_member(db: Session, user_id: int, channel_id: int) -> bool:
+    """One probe of the channel_members primary key; never loads the member list."""
+    return db.query(exists().where(
+        channel_members.c.user_id == user_id, channel_members.c.channel_id == channel_id
+    )).scalar()
+
+
+def can_access_channel(db: Session, user: User, channel: Channel) -> bool:
+    """Admins, the channel's creator and its members; membership comes from the cache when it can."""
+    if user.is_admin or channel.created_by == user.id:
+        return True
+    allowed = channel_access.get(user.id, channel.id)
+    if allowed is None:
+        generation = channel_access.generation(user.id, channel.id)
+        allowed = is_member(db, user.id, channel.id)
+        channel_access.put(user.id, channel.id, allowed, generation)
+    return allowed
@@ -0,0 +1,613 @@
+import asyncio
+import logging
+import os
+import uuid
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+from fastapi import WebSocket, status
+from models import User
+from event_bus import create_event_bus
+import json_codec
+
+logger = logging.getLogger("ws_manager")
+
+# How many outbound frames a socket may have pending before it counts as a slow consumer
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+# Seconds a single send may block before the socket is dropped
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Seconds to wait for a close frame to go out on an evicted socket
+CLOSE_TIMEOUT = 1.0
+# Recent events kept per channel for replay to reconnecting sockets
+REPLAY_BUFFER_SIZE = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "100"))
+# All channels' replay buffers together; the least recently active channels' buffers go first
+REPLAY_BUFFER_MB = float(os.getenv("WS_REPLAY_BUFFER_MB", "32"))
+# Seconds between server pings; clients answer with {"type": "pong"}
+PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "25"))
+# Seconds without any inbound frame (pongs included) before a socket counts as dead
+IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+# Admission limits: open sockets per user (tabs, devices) and per process
+MAX_CONNECTIONS_PER_USER = int(os.getenv("WS_MAX_CONNECTIONS_PER_USER", "10"))
+MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Milliseconds to collect a channel's events into one array frame; 0 sends each event at once
+COALESCE_MS = float(os.getenv("WS_COALESCE_MS", "0"))
+# Per-channel overrides of COALESCE_MS, e.g. "1=20,42=5"
+COALESCE_CHANNEL_MS = os.getenv("WS_COALESCE_CHANNEL_MS", "")
+# Seconds a typing indicator stays up on clients unless it is refreshed
+TYPING_TTL = float(os.getenv("WS_TYPING_TTL", "5"))
+# A user's typing notifications for one channel are forwarded at most once per this many seconds
+TYPING_THROTTLE = float(os.getenv("WS_TYPING_THROTTLE", "2"))
+# Typing notifications fanned out per channel per second, whoever sends them
+TYPING_CHANNEL_RATE = int(os.getenv("WS_TYPING_CHANNEL_RATE", "10"))
+# Channels with more subscribers than this get no presence pushes; clients ask for the list instead
+PRESENCE_BROADCAST_LIMIT = int(os.getenv("WS_PRESENCE_BROADCAST_LIMIT", "500"))
+# Users per "members" event, which keeps it well inside a Postgres NOTIFY payload
+MEMBERS_EVENT_IDS = 500
+
+
+def parse_channel_overrides(value: str, setting: str) -> Dict[int, float]:
+    """Parses per-channel settings written as "channel_id=value,channel_id=value"."""
+    overrides = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        try:
+            channel_id, number = item.split("=", 1)
+            overrides[int(channel_id)] = float(number)
+        except ValueError:
+            logger.warning("Ignoring malformed %s entry: %r", setting, item)
+    return overrides
+
+
+class Connection:
+    """An accepted socket with its own bounded outbound queue and writer task."""
+
+    def __init__(self, websocket: WebSocket, user_id: int, username: str, is_admin: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.username = username
+        self.is_admin = is_admin
+        self.channels: Set[int] = set()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+        self.closed = False
+        self.last_seen = asyncio.get_running_loop().time()
+
+
+class ConnectionManager:
+    """Tracks this worker's sockets and applies events arriving from the event bus.
+
+    The public subscribe/broadcast methods only publish to the bus; every
+    worker (including this one) then applies them to the sockets it holds.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.active_connections: Set[Connection] = set()
+        # user_id -> that user's open connections (one per tab / device)
+        self.user_connections: Dict[int, Set[Connection]] = {}
+        # channel_id -> connections that should receive that channel's events
+        self.channel_subscribers: Dict[int, Set[Connection]] = {}
+        # Admins can read every channel, so they get every channel's events
+        self.admin_connections: Set[Connection] = set()
+        self.stats: Dict[str, int] = {
+            "queued": 0,
+            "sent": 0,
+            "dropped_queue_overflow": 0,
+            "dropped_send_timeout": 0,
+            "dropped_send_error": 0,
+            "evicted_idle": 0,
+            "closed_user_deleted": 0,
+            "closed_user_changed": 0,
+            "rejected_user_limit": 0,
+            "rejected_process_limit": 0,
+            "batches": 0,
+            "batched_events": 0,
+            "typing_throttled": 0,
+            "typing_rate_limited": 0,
+            "skipped_ephemeral": 0,
+            "replay_buffers_evicted": 0,
+        }
+        self._heartbeat: Optional[asyncio.Task] = None
+        # The loop that owns the sockets; set by start()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # Other per-worker state kept current by the same events (e.g. the message cache)
+        self.listeners: List[Callable[[dict], None]] = []
+        # Keeps fire-and-forget close tasks referenced until they finish
+        self._background: Set[asyncio.Task] = set()
+        # Sequence numbers are only comparable within one process lifetime;
+        # a client resuming against another epoch has to reload
+        self.epoch = uuid.uuid4().hex[:12]
+        # channel_id -> last sequence number handed out
+        self.channel_seq: Dict[int, int] = {}
+        # channel_id -> (seq, encoded frame) of the most recent events, least recently active channel first
+        self.history: "OrderedDict[int, Deque[Tuple[int, str]]]" = OrderedDict()
+        # Encoded size of every buffered frame, against REPLAY_BUFFER_MB
+        self.history_bytes = 0
+        self.max_history_bytes = int(REPLAY_BUFFER_MB * 1024 * 1024)
+        # Coalescing window in seconds: default and per-channel overrides
+        self.coalesce_window = COALESCE_MS / 1000
+        self.coalesce_channel_window = {
+            channel_id: ms / 1000 for channel_id, ms in parse_channel_overrides(COALESCE_CHANNEL_MS, "WS_COALESCE_CHANNEL_MS").items()
+        }
+        # channel_id -> encoded frames waiting for that channel's window to close
+        self._pending: Dict[int, List[str]] = {}
+        # Presence and typing live only here, never in the database.
+        # user_id -> epochs of the workers holding at least one socket of that user
+        self.online_users: Dict[int, Set[str]] = {}
+        # channel_id -> online users subscribed to that channel
+        self.channel_presence: Dict[int, Set[int]] = {}
+        # (user_id, channel_id) -> when this worker last forwarded that user's typing
+        self._typing_sent: Dict[Tuple[int, int], float] = {}
+        # channel_id -> (start of the current one-second window, typing events fanned out in it)
+        self._typing_window: Dict[int, Tuple[float, int]] = {}
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        """listener(event) is called for every event this worker receives from the bus."""
+        self.listeners.append(listener)
+
+    def publish(self, event: dict):
+        """Hands an event to the bus; safe to call from any thread.
+
+        Sync endpoints run in the threadpool, but the bus, the socket
+        registry and the send queues belong to the event loop, so events
+        published off the loop are passed over with call_soon_threadsafe
+        (in order). Also used directly for listener-only ops.
+        """
+        loop = self.loop
+        if loop is None or self._on_loop(loop):
+            self.bus.publish(event)
+        else:
+            loop.call_soon_threadsafe(self.bus.publish, event)
+
+    @staticmethod
+    def _on_loop(loop: asyncio.AbstractEventLoop) -> bool:
+        try:
+            return asyncio.get_running_loop() is loop
+        except RuntimeError:
+            return False
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.bus.start(self._dispatch)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        await self.bus.stop()
+
+    async def connect(self, websocket: WebSocket, user: User, channel_ids: List[int] = (), resume: Optional[dict] = None) -> Optional[Connection]:
+        """Accepts and registers the socket, or closes it and returns None when a limit is reached."""
+        # Accepting first lets the client see the close code instead of a failed handshake
+        await websocket.accept()
+        if len(self.active_connections) >= MAX_CONNECTIONS:
+            self.stats["rejected_process_limit"] += 1
+            await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+            return None
+        if len(self.user_connections.get(user.id, ())) >= MAX_CONNECTIONS_PER_USER:
+            self.stats["rejected_user_limit"] += 1
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return None
+        connection = Connection(websocket, user.id, user.username, user.is_admin)
+        connection.writer = asyncio.create_task(self._writer(connection))
+        self.active_connections.add(connection)
+        self.user_connections.setdefault(user.id, set()).add(connection)
+        if connection.is_admin:
+            self.admin_connections.add(connection)
+        for channel_id in channel_ids:
+            self._add_subscription(connection, channel_id)
+        # No await between registering and replaying, so no live event can
+        # overtake the replayed ones
+        self._greet(connection, resume)
+        if len(self.user_connections[user.id]) == 1:
+            self._publish_presence(connection, True)
+        return connection
+
+    def _greet(self, connection: Connection, resume: Optional[dict]):
+        """Sends hello with the current sequence numbers, then replays what a resuming client missed.
+
+        resume is {"epoch": str, "seqs": {channel_id: last seen seq}}. Channels
+        whose gap is no longer in the buffer (or another epoch) are listed in
+        a "resync" frame so the client reloads them over HTTP.
+        """
+        visible = self.channel_seq.keys() if connection.is_admin else connection.channels
+        self.reply(connection, {
+            "type": "hello",
+            "epoch": self.epoch,
+            "seqs": {str(channel_id): self.channel_seq[channel_id] for channel_id in visible if channel_id in self.channel_seq},
+        })
+        if not resume:
+            return
+        resync = []
+        replay = []
+        # Leave room in the queue for live traffic
+        budget = SEND_QUEUE_SIZE // 2
+        same_epoch = resume.get("epoch") == self.epoch
+        for key, last_seq in (resume.get("seqs") or {}).items():
+            try:
+                channel_id, last_seq = int(key), int(last_seq)
+            except (TypeError, ValueError):
+                continue
+            if not connection.is_admin and channel_id not in connection.channels:
+                continue
+            current = self.channel_seq.get(channel_id, 0)
+            if same_epoch and last_seq >= current:
+                continue
+            history = self.history.get(channel_id)
+            missed = current - last_seq
+            if not same_epoch or not history or history[0][0] > last_seq + 1 or missed > budget:
+                resync.append(channel_id)
+                continue
+            budget -= missed
+            replay.extend(frame for seq, frame in history if seq > last_seq)
+        self._enqueue([connection], replay)
+        if resync:
+            self.reply(connection, {"type": "resync", "channel_ids": resync})
+
+    def disconnect(self, connection: Connection):
+        # Safe to call twice: once from eviction and once from the receive loop
+        if connection.closed:
+            return
+        connection.closed = True
+        self.active_connections.discard(connection)
+        user_connections = self.user_connections.get(connection.user_id)
+        if user_connections is not None:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.user_connections[connection.user_id]
+                # Last socket of this user on this worker
+                self._publish_presence(connection, False)
+        for channel_id in connection.channels:
+            self._remove_subscription(connection, channel_id)
+        connection.channels.clear()
+        self.admin_connections.discard(connection)
+        if connection.writer is not None and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
+
+    def _add_subscription(self, connection: Connection, channel_id: int):
+        self.channel_subscribers.setdefault(channel_id, set()).add(connection)
+        connection.channels.add(channel_id)
+
+    def _remove_subscription(self, connection: Connection, channel_id: int):
+        subscribers = self.channel_subscribers.get(channel_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.channel_subscribers[channel_id]
+
+    # --- Published through the bus ---
+
+    def subscribe(self, user_id: int, channel_id: int):
+        self.publish({"op": "subscribe", "user_id": user_id, "channel_id": channel_id})
+
+    def unsubscribe(self, user_id: int, channel_id: int):
+        self.publish({"op": "unsubscribe", "user_id": user_id, "channel_id": channel_id})
+
+    def change_members(self, channel_id: int, added: List[int] = (), removed: List[int] = ()):
+        """A batch of membership changes as "members" events of up to MEMBERS_EVENT_IDS users each:
+        subscribes or unsubscribes them and tells them with channel_added / channel_removed,
+        like subscribe + send_to_user for every user."""
+        changes = [("added", user_id) for user_id in added] + [("removed", user_id) for user_id in removed]
+        for start in range(0, len(changes), MEMBERS_EVENT_IDS):
+            chunk = changes[start:start + MEMBERS_EVENT_IDS]
+            self.publish({
+                "op": "members",
+                "channel_id": channel_id,
+                "added": [user_id for kind, user_id in chunk if kind == "added"],
+                "removed": [user_id for kind, user_id in chunk if kind == "removed"],
+            })
+
+    def drop_user(self, user_id: int):
+        """The account is gone: its sockets are closed on every worker."""
+        self.publish({"op": "drop_user", "user_id": user_id})
+
+    def refresh_user(self, user_id: int):
+        """The account's rights changed: its sockets are closed and reconnect with what is current."""
+        self.publish({"op": "refresh_user", "user_id": user_id})
+
+    def drop_channel(self, channel_id: int):
+        self.publish({"op": "drop_channel", "channel_id": channel_id})
+
+    def broadcast(self, message: dict):
+        self.publish({"op": "all", "message": message})
+
+    def broadcast_to_channel(self, channel_id: int, message: dict):
+        self.publish({"op": "channel", "channel_id": channel_id, "message": message})
+
+    def send_to_user(self, user_id: int, message: dict):
+        self.publish({"op": "user", "user_id": user_id, "message": message})
+
+    def typing(self, connection: Connection, channel_id: int):
+        """Forwards a "user is typing" notification unless this user sent one for the channel very recently."""
+        now = asyncio.get_running_loop().time()
+        key = (connection.user_id, channel_id)
+        if now - self._typing_sent.get(key, float("-inf")) < TYPING_THROTTLE:
+            self.stats["typing_throttled"] += 1
+            return
+        self._typing_sent[key] = now
+        self.publish({
+            "op": "typing",
+            "channel_id": channel_id,
+            "user_id": connection.user_id,
+            "username": connection.username,
+        })
+
+    def _publish_presence(self, connection: Connection, online: bool):
+        self.publish({
+            "op": "presence",
+            "worker": self.epoch,
+            "user_id": connection.user_id,
+            "username": connection.username,
+            "online": online,
+            "channel_ids": list(connection.channels),
+        })
+
+    def online_in_channel(self, channel_id: int) -> List[int]:
+        return list(self.channel_presence.get(channel_id, ()))
+
+    def reply(self, connection: Connection, message: dict):
+        # Answers to a socket's own frames stay on this worker
+        self._fan_out([connection], message)
+
+    # --- Applied locally on every worker ---
+
+    def _dispatch(self, event: dict):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception("Event listener failed")
+        op = event["op"]
+        if op == "channel":
+            self._channel_event(event["channel_id"], event["message"])
+        elif op == "user":
+            self._fan_out(list(self.user_connections.get(event["user_id"], ())), event["message"])
+        elif op == "all":
+            self._fan_out(list(self.active_connections), event["message"])
+        elif op == "typing":
+            self._typing_event(event)
+        elif op == "presence":
+            self._presence_event(event)
+        elif op == "subscribe":
+            self._subscribe_user(event["user_id"], event["channel_id"])
+        elif op == "unsubscribe":
+            self._unsubscribe_user(event["user_id"], event["channel_id"])
+        elif op == "members":
+            channel_id = event["channel_id"]
+            for user_id in event["added"]:
+                self._subscribe_user(user_id, channel_id)
+                self._fan_out(list(self.user_connections.get(user_id, ())), {"type": "channel_added", "id": channel_id})
+            for user_id in event["removed"]:
+                self._unsubscribe_user(user_id, channel_id)
+                self._fan_out(list(self.user_connections.get(user_id, ())), {"type": "channel_removed", "id": channel_id})
+        elif op == "drop_user":
+            # The socket authorized once at connect; a deleted account must not keep using it
+            for connection in list(self.user_connections.get(event["user_id"], ())):
+                self._evict(connection, "closed_user_deleted")
+        elif op == "refresh_user":
+            # is_admin and channels are cached per socket; the reconnect loads them again
+            for connection in list(self.user_connections.get(event["user_id"], ())):
+                self._evict(connection, "closed_user_changed", status.WS_1012_SERVICE_RESTART)
+        elif op == "drop_channel":
+            # The channel_deleted event may still sit in the window
+            self._flush(event["channel_id"])
+            for connection in self.channel_subscribers.pop(event["channel_id"], set()):
+                connection.channels.discard(event["channel_id"])
+            self.channel_seq.pop(event["channel_id"], None)
+            self._drop_history(event["channel_id"])
+            self.channel_presence.pop(event["channel_id"], None)
+            self._typing_window.pop(event["channel_id"], None)
+        elif not self.listeners:
+            logger.warning("Unknown event bus op: %s", op)
+
+    def _subscribe_user(self, user_id: int, channel_id: int):
+        for connection in self.user_connections.get(user_id, ()):
+            self._add_subscription(connection, channel_id)
+        if user_id in self.online_users:
+            self.channel_presence.setdefault(channel_id, set()).add(user_id)
+
+    def _unsubscribe_user(self, user_id: int, channel_id: int):
+        for connection in list(self.user_connections.get(user_id, ())):
+            connection.channels.discard(channel_id)
+            self._remove_subscription(connection, channel_id)
+        self._remove_presence(channel_id, user_id)
+
+    def _remember(self, channel_id: int, seq: int, frame: str):
+        history = self.history.get(channel_id)
+        if history is None:
+            history = self.history[channel_id] = deque(maxlen=REPLAY_BUFFER_SIZE)
+        elif len(history) == history.maxlen:
+            # The append pushes the oldest frame out
+            self.history_bytes -= len(history[0][1])
+        history.append((seq, frame))
+        self.history_bytes += len(frame)
+        self.history.move_to_end(channel_id)
+        # Clients resuming a channel whose buffer went get a resync, as after any gap too old to replay
+        while self.history_bytes > self.max_history_bytes and len(self.history) > 1:
+            self._drop_history(next(iter(self.history)))
+            self.stats["replay_buffers_evicted"] += 1
+
+    def _drop_history(self, channel_id: int):
+        history = self.history.pop(channel_id, None)
+        if history is not None:
+            self.history_bytes -= sum(len(frame) for _, frame in history)
+
+    def _channel_event(self, channel_id: int, message: dict):
+        seq = self.channel_seq.get(channel_id, 0) + 1
+        self.channel_seq[channel_id] = seq
+        frame = json_codec.dumps({**message, "seq": seq})
+        self._remember(channel_id, seq, frame)
+        window = self.coalesce_channel_window.get(channel_id, self.coalesce_window)
+        if window <= 0:
+            self._enqueue(self.channel_subscribers.get(channel_id, set()) | self.admin_connections, [frame])
+            return
+        pending = self._pending.get(channel_id)
+        if pending is None:
+            # The window opens with the first event, so no event waits longer than it
+            pending = self._pending[channel_id] = []
+            asyncio.get_running_loop().call_later(window, self._flush, channel_id)
+        pending.append(frame)
+
+    def _flush(self, channel_id: int):
+        """Sends a channel's pending events as one frame, a JSON array when there are several."""
+        frames = self._pending.pop(channel_id, None)
+        if not frames:
+            return
+        if len(frames) == 1:
+            frame = frames[0]
+        else:
+            # The events are already encoded; joining them avoids a second encode
+            frame = "[" + ",".join(frames) + "]"
+            self.stats["batches"] += 1
+            self.stats["batched_events"] += len(frames)
+        self._enqueue(self.channel_subscribers.get(channel_id, set()) | self.admin_connections, [frame])
+
+    def _typing_event(self, event: dict):
+        # Channel-wide cap: however many members type at once, the fan-out stays bounded
+        channel_id = event["channel_id"]
+        now = asyncio.get_running_loop().time()
+        window_start, count = self._typing_window.get(channel_id, (now, 0))
+        if now - window_start >= 1:
+            window_start, count = now, 0
+        if count >= TYPING_CHANNEL_RATE:
+            self.stats["typing_rate_limited"] += 1
+            return
+        self._typing_window[channel_id] = (window_start, count + 1)
+        # No seq and no history: a missed typing notification is never replayed
+        self._fan_out(self.channel_subscribers.get(channel_id, set()) | self.admin_connections, {
+            "type": "typing",
+            "channel_id": channel_id,
+            "user_id": event["user_id"],
+            "username": event["username"],
+            "ttl": TYPING_TTL,
+        }, ephemeral=True)
+
+    def _presence_event(self, event: dict):
+        user_id = event["user_id"]
+        workers = self.online_users.get(user_id, set())
+        was_online = bool(workers)
+        if event["online"]:
+            workers.add(event["worker"])
+            self.online_users[user_id] = workers
+        else:
+            workers.discard(event["worker"])
+            if not workers:
+                self.online_users.pop(user_id, None)
+        if was_online == bool(workers):
+            # Another tab or worker already had this user online
+            return
+        recipients = set()
+        for channel_id in event["channel_ids"]:
+            if event["online"]:
+                self.channel_presence.setdefault(channel_id, set()).add(user_id)
+            else:
+                self._remove_presence(channel_id, user_id)
+            subscribers = self.channel_subscribers.get(channel_id, ())
+            if len(subscribers) <= PRESENCE_BROADCAST_LIMIT:
+                recipients.update(subscribers)
+        self._fan_out(recipients, {
+            "type": "presence",
+            "user_id": user_id,
+            "username": event["username"],
+            "online": event["online"],
+        }, ephemeral=True)
+
+    def _remove_presence(self, channel_id: int, user_id: int):
+        online = self.channel_presence.get(channel_id)
+        if online is not None:
+            online.discard(user_id)
+            if not online:
+                del self.channel_presence[channel_id]
+
+    def _fan_out(self, connections, message: dict, ephemeral: bool = False):
+        # Encoded once; every recipient gets the same text frame
+        self._enqueue(connections, [json_codec.dumps(message)], ephemeral)
+
+    def _enqueue(self, connections, frames: List[str], ephemeral: bool = False):
+        # Never awaits: a stalled socket only fills its own queue
+        for connection in connections:
+            if ephemeral and connection.queue.qsize() >= SEND_QUEUE_SIZE // 2:
+                # Typing and presence are best effort: a busy socket skips them
+                # rather than being evicted (e.g. a presence storm after a restart)
+                self.stats["skipped_ephemeral"] += 1
+                continue
+            try:
+                for frame in frames:
+                    connection.queue.put_nowait(frame)
+                    self.stats["queued"] += 1
+            except asyncio.QueueFull:
+                self._evict(connection, "dropped_queue_overflow")
+
+    async def _writer(self, connection: Connection):
+        try:
+            while True:
+                frame = await connection.queue.get()
+                await self._send(connection, frame)
+                self.stats["sent"] += 1
+        except asyncio.TimeoutError:
+            self._evict(connection, "dropped_send_timeout")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._evict(connection, "dropped_send_error")
+
+    def touch(self, connection: Connection):
+        connection.last_seen = asyncio.get_running_loop().time()
+
+    async def _heartbeat_loop(self):
+        ping = json_codec.dumps({"type": "ping"})
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(PING_INTERVAL)
+            deadline = loop.time() - IDLE_TIMEOUT
+            for connection in list(self.active_connections):
+                if connection.last_seen < deadline:
+                    self._evict(connection, "evicted_idle")
+            self._enqueue(list(self.active_connections), [ping])
+            self._prune_typing(loop.time())
+
+    def _prune_typing(self, now: float):
+        self._typing_sent = {key: sent for key, sent in self._typing_sent.items() if now - sent < TYPING_THROTTLE}
+        self._typing_window = {
+            channel_id: window for channel_id, window in self._typing_window.items() if now - window[0] < 1
+        }
+
+    async def _send(self, connection: Connection, frame: str):
+        # asyncio.timeout (3.11+) is a deadline on the writer task itself;
+        # wait_for wraps every send in a new task, which costs more than the send
+        if hasattr(asyncio, "timeout"):
+            async with asyncio.timeout(SEND_TIMEOUT):
+                await connection.websocket.send_text(frame)
+        else:
+            await asyncio.wait_for(connection.websocket.send_text(frame), SEND_TIMEOUT)
+
+    def _evict(self, connection: Connection, reason: str, code: int = status.WS_1008_POLICY_VIOLATION):
+        if connection.closed:
+            return
+        self.stats[reason] += 1
+        logger.warning("Dropping WebSocket of user %s: %s", connection.user_id, reason)
+        self.disconnect(connection)
+        task = asyncio.create_task(self._close(connection, code))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _close(self, connection: Connection, code: int):
+        try:
+            await asyncio.wait_for(connection.websocket.close(code=code), CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+    def snapshot(self) -> dict:
+        return {
+            "connections": len(self.active_connections),
+            "evicted": sum(count for name, count in self.stats.items() if name.startswith(("dropped_", "evicted_"))),
+            "rejected": self.stats["rejected_user_limit"] + self.stats["rejected_process_limit"],
+            "users": len(self.user_connections),
+            "channels": len(self.channel_subscribers),
+            "online_users": len(self.online_users),
+            "replay_bytes": self.history_bytes,
+            **self.stats,
+        }
+
+
+manager = ConnectionManager(create_event_bus())
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from sqlalchemy.engine import make_url
+from database import SQLALCHEMY_DATABASE_URL
+import json_codec
+
+logger = logging.getLogger("event_bus")
+
+# "memory" for a single uvicorn worker, "postgres" to share events between workers and hosts
+EVENT_BUS = os.getenv("EVENT_BUS", "memory")
+# Postgres NOTIFY channel used by every worker
+PG_CHANNEL = os.getenv("EVENT_BUS_CHANNEL", "messager_events")
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+PG_MAX_PAYLOAD = 7999
+# Larger events are stored here and only their row id goes through NOTIFY
+PG_PAYLOAD_TABLE = "event_bus_payloads"
+# Seconds a stored event is kept; every worker reads it as soon as the NOTIFY arrives
+PG_PAYLOAD_TTL = 300
+# Seconds between attempts to re-establish a lost LISTEN connection
+PG_RECONNECT_DELAY = 2.0
+
+Handler = Callable[[dict], None]
+
+
+class InProcessEventBus:
+    """Delivers published events straight back to this process (single worker, tests)."""
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def stop(self):
+        self._handler = None
+
+    def publish(self, event: dict):
+        if self._handler is not None:
+            self._handler(event)
+
+
+class PostgresEventBus:
+    """Fans events out to every worker through Postgres LISTEN/NOTIFY.
+
+    Each worker holds one LISTEN connection watched by the event loop and one
+    connection for NOTIFY. Publishing runs on a single background thread so
+    events from this worker keep their order and never block the loop.
+    The publishing worker receives its own events back like everyone else.
+    Events too large for a NOTIFY payload are sent by reference: the JSON
+    goes into PG_PAYLOAD_TABLE and the NOTIFY carries {"ref": row id}.
+    """
+
+    def __init__(self, dsn: str, channel: str = PG_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self._handler: Optional[Handler] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._listen_conn = None
+        self._publish_conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-bus")
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._payload_table_ready = False
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._listen()
+
+    async def stop(self):
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        self._close_listener()
+        await self._loop.run_in_executor(self._executor, self._close_publisher)
+        self._executor.shutdown(wait=False)
+
+    def publish(self, event: dict):
+        self._loop.run_in_executor(self._executor, self._notify, json_codec.dumps(event))
+
+    def _connect(self):
+        import psycopg2
+        import psycopg2.extensions
+        conn = psycopg2.connect(self.dsn)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn
+
+    def _listen(self):
+        self._listen_conn = self._connect()
+        with self._listen_conn.cursor() as cur:
+            cur.execute(f'LISTEN "{self.channel}"')
+        self._loop.add_reader(self._listen_conn.fileno(), self._on_readable)
+        logger.info("Listening for chat events on Postgres channel %s", self.channel)
+
+    def _close_listener(self):
+        if self._listen_conn is None:
+            return
+        try:
+            self._loop.remove_reader(self._listen_conn.fileno())
+            self._listen_conn.close()
+        except Exception:
+            pass
+        self._listen_conn = None
+
+    def _on_readable(self):
+        try:
+            self._listen_conn.poll()
+        except Exception as e:
+            logger.error("Lost LISTEN connection: %s", e)
+            self._close_listener()
+            self._reconnect_task = self._loop.create_task(self._reconnect())
+            return
+        while self._listen_conn.notifies:
+            notify = self._listen_conn.notifies.pop(0)
+            try:
+                event = json_codec.loads(notify.payload)
+                if "op" not in event:
+                    event = self._load_stored(event["ref"])
+                self._handler(event)
+            except Exception:
+                logger.exception("Failed to handle chat event")
+
+    def _load_stored(self, ref: int) -> dict:
+        # A primary key lookup on the LISTEN connection, which is idle between notifications
+        with self._listen_conn.cursor() as cur:
+            cur.execute(f"SELECT payload FROM {PG_PAYLOAD_TABLE} WHERE id = %s", (ref,))
+            row = cur.fetchone()
+        if row is None:
+            raise LookupError(f"Stored event {ref} is gone")
+        return json_codec.loads(row[0])
+
+    async def _reconnect(self):
+        while True:
+            await asyncio.sleep(PG_RECONNECT_DELAY)
+            try:
+                self._listen()
+                return
+            except Exception as e:
+                logger.error("Reconnecting LISTEN connection failed: %s", e)
+
+    def _notify(self, payload: str):
+        # Runs on the bus thread only
+        for attempt in range(2):
+            try:
+                if self._publish_conn is None or self._publish_conn.closed:
+                    self._publish_conn = self._connect()
+                with self._publish_conn.cursor() as cur:
+                    notify_payload = payload
+                    if len(payload.encode("utf-8")) > PG_MAX_PAYLOAD:
+                        notify_payload = json_codec.dumps({"ref": self._store(cur, payload)})
+                    cur.execute("SELECT pg_notify(%s, %s)", (self.channel, notify_payload))
+                return
+            except Exception as e:
+                logger.error("NOTIFY failed (attempt %d): %s", attempt + 1, e)
+                self._close_publisher()
+
+    def _store(self, cur, payload: str) -> int:
+        """Saves an oversized event (autocommit, so it is visible before the NOTIFY) and drops expired ones."""
+        if not self._payload_table_ready:
+            cur.execute(
+                f"CREATE TABLE IF NOT EXISTS {PG_PAYLOAD_TABLE} ("
+                "id BIGSERIAL PRIMARY KEY, payload TEXT NOT NULL, created_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+            )
+            self._payload_table_ready = True
+        cur.execute(f"DELETE FROM {PG_PAYLOAD_TABLE} WHERE created_at < now() - make_interval(secs => %s)", (PG_PAYLOAD_TTL,))
+        cur.execute(f"INSERT INTO {PG_PAYLOAD_TABLE} (payload) VALUES (%s) RETURNING id", (payload,))
+        return cur.fetchone()[0]
+
+    def _close_publisher(self):
+        if self._publish_conn is not None:
+            try:
+                self._publish_conn.close()
+            except Exception:
+                pass
+            self._publish_conn = None
+
+
+def create_event_bus():
+    if EVENT_BUS == "postgres":
+        url = make_url(SQLALCHEMY_DATABASE_URL)
+        if not url.drivername.startswith("postgresql"):
+            raise RuntimeError("EVENT_BUS=postgres requires a PostgreSQL DATABASE_URL")
+        # psycopg2 takes a plain libpq URI, without the SQLAlchemy driver suffix
+        return PostgresEventBus(url.set(drivername="postgresql").render_as_string(hide_password=False))
+    return InProcessEventBus()
@@ -0,0 +1,30 @@
+import json
+from fastapi.responses import JSONResponse
+
+# orjson is optional: several times faster, but the stdlib encoder works everywhere
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj) -> str:
+    """Encodes obj as compact JSON text (WebSocket text frames and NOTIFY payloads need str)."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class: renders with orjson when it is installed."""
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return super().render(content)
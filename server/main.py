@@ -1,9 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from database import engine, Base, SessionLocal
+from migrate import add_all_users_to_channel, run_migrations
 from models import User
 from auth_dependencies import get_password_hash
-from routers import auth, chat, admin, files
+from routers import auth, chat, admin, files, search, export, sync
+from connection_manager import manager
+from message_writer import message_writer
+from json_codec import FastJSONResponse
 from fastapi.staticfiles import StaticFiles
 import os
 import time
@@ -15,10 +19,11 @@ from fastapi import FastAPI, Request
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("api_logger")
 
-# Create tables
+# Create tables, then bring existing databases up to the current schema
 Base.metadata.create_all(bind=engine)
+run_migrations(engine)
 
-app = FastAPI(title="Messager API")
+app = FastAPI(title="Messager API", default_response_class=FastJSONResponse)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -66,6 +71,9 @@ app.include_router(auth.router)
 app.include_router(chat.router)
 app.include_router(admin.router)
 app.include_router(files.router)
+app.include_router(search.router)
+app.include_router(export.router)
+app.include_router(sync.router)
 from routers import utils
 app.include_router(utils.router)
 
@@ -77,6 +85,16 @@ def read_root():
         "status": "ready"
     }
 
+@app.on_event("startup")
+async def start_event_bus():
+    await manager.start()
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    # Messages still in the group-commit window are written before the bus goes away
+    await message_writer.close()
+    await manager.stop()
+
 @app.on_event("startup")
 def startup_event():
     # Create default admin if not exists
@@ -95,25 +113,11 @@ def startup_event():
         default_channel = db.query(Channel).filter(Channel.name == "Общий").first()
         if not default_channel:
             new_channel = Channel(name="Общий", created_by=admin_user.id if admin_user else 1)
-            # Add creator as member if available
-            if admin_user:
-                new_channel.members.append(admin_user)
             db.add(new_channel)
+            db.flush()
+            # Everyone, the admin included, is a member; later users join when they are created
+            add_all_users_to_channel(db.connection(), new_channel.id)
             db.commit()
-            db.refresh(new_channel)
-            default_channel = new_channel
             print("Default channel 'Общий' created")
-        
-        # Ensure all existing users are members of the default channel
-        all_users = db.query(User).all()
-        added_count = 0
-        for u in all_users:
-            if u not in default_channel.members:
-                default_channel.members.append(u)
-                added_count += 1
-        
-        if added_count > 0:
-            db.commit()
-            print(f"Synced {added_count} users to 'Общий' channel")
     finally:
         db.close()
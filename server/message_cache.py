@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from connection_manager import manager
+
+# Memory budget for cached messages, in MB; 0 turns the cache off
+MESSAGE_CACHE_MB = float(os.getenv("MESSAGE_CACHE_MB", "64"))
+# Newest messages kept per channel; first pages up to this size are served from memory
+MESSAGE_CACHE_DEPTH = int(os.getenv("MESSAGE_CACHE_DEPTH", "100"))
+# Seconds after a fill before a channel is read from the database again; the bus keeps entries
+# current sooner, this bounds how long an event the worker never got (a lost NOTIFY) can be missing
+MESSAGE_CACHE_TTL = float(os.getenv("MESSAGE_CACHE_TTL", "60"))
+# Rough per-message cost of the dict and its small fields, on top of the text
+ENTRY_OVERHEAD = 400
+
+
+def message_size(message: dict) -> int:
+    return ENTRY_OVERHEAD + sum(len(message.get(key) or "") for key in ("content", "image_url", "thumbnail_url"))
+
+
+def slice_page(items: List[dict], limit: int, complete: bool) -> dict:
+    """The newest `limit` of items (oldest first) in the get_messages envelope."""
+    page = items[-limit:]
+    has_more = len(items) > limit or not complete
+    return {"items": page, "has_more": has_more, "next_cursor": page[0]["id"] if has_more and page else None}
+
+
+class ChannelEntry:
+    __slots__ = ("messages", "complete", "size", "expires_at")
+
+    def __init__(self, messages: List[dict], complete: bool, expires_at: float):
+        # Oldest first; complete means these are all the channel's messages
+        self.messages = messages
+        self.complete = complete
+        self.size = sum(message_size(message) for message in messages)
+        # Events do not extend it: only a fresh read from the database does
+        self.expires_at = expires_at
+
+
+class RecentMessagesCache:
+    """LRU of each channel's newest messages, kept current by the event bus.
+
+    Every worker applies new_message / message_deleted / drop_channel events
+    from the bus to its own copy, so with EVENT_BUS=postgres all workers stay
+    in step. A fill read from the database is discarded if an event for that
+    channel arrived meanwhile (per-channel generation counter). Entries are
+    refilled at least every ttl seconds in case an event never arrived.
+    """
+
+    def __init__(self, max_bytes: int, depth: int, ttl: float = MESSAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.depth = depth
+        self.ttl = ttl
+        self.entries: "OrderedDict[int, ChannelEntry]" = OrderedDict()
+        self.size = 0
+        # channel_id -> number of events applied; only channels seen since start
+        self.generations: Dict[int, int] = {}
+        # Bumped by invalidate_messages, which makes every fill in flight stale
+        self.epoch = 0
+        # Requests read from the threadpool, events arrive on the event loop
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "stale_fills": 0, "expired": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and self.depth > 0 and self.ttl > 0
+
+    def covers(self, limit: int) -> bool:
+        return self.enabled and limit <= self.depth
+
+    def get_page(self, channel_id: int, limit: int) -> Optional[dict]:
+        with self.lock:
+            entry = self.entries.get(channel_id)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._discard(channel_id)
+                self.stats["expired"] += 1
+                entry = None
+            # Deletes can leave fewer messages than asked for; the database has the rest
+            if entry is None or (len(entry.messages) < limit and not entry.complete):
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(channel_id)
+            self.stats["hits"] += 1
+            return slice_page(entry.messages, limit, entry.complete)
+
+    def generation(self, channel_id: int) -> Tuple[int, int]:
+        with self.lock:
+            return self.epoch, self.generations.get(channel_id, 0)
+
+    def fill(self, channel_id: int, generation: Tuple[int, int], messages: List[dict], complete: bool):
+        """Stores the newest messages read from the database, unless an event made them stale."""
+        with self.lock:
+            if (self.epoch, self.generations.get(channel_id, 0)) != generation:
+                self.stats["stale_fills"] += 1
+                return
+            self._discard(channel_id)
+            entry = ChannelEntry(messages[-self.depth:], complete and len(messages) <= self.depth, time.monotonic() + self.ttl)
+            self.entries[channel_id] = entry
+            self.size += entry.size
+            self._evict()
+
+    def apply_event(self, event: dict):
+        op = event["op"]
+        if op == "channel":
+            message = event["message"]
+            if message["type"] == "new_message":
+                self._append(event["channel_id"], message["message"])
+            elif message["type"] == "message_deleted":
+                self._remove(event["channel_id"], message["id"])
+        elif op == "drop_channel":
+            with self.lock:
+                self._discard(event["channel_id"])
+                # Bumped, not dropped: a fill in flight for the deleted channel must not land
+                self._bump(event["channel_id"])
+        elif op == "invalidate_messages":
+            # Changes made without per-message events (e.g. a deleted author)
+            with self.lock:
+                self.entries.clear()
+                self.size = 0
+                self.epoch += 1
+
+    def _append(self, channel_id: int, message: dict):
+        with self.lock:
+            self._bump(channel_id)
+            entry = self.entries.get(channel_id)
+            if entry is None:
+                return
+            if entry.messages and entry.messages[-1]["id"] >= message["id"]:
+                # Replayed or out-of-order event: let the next read refill
+                self._discard(channel_id)
+                return
+            entry.messages.append(message)
+            entry.size += message_size(message)
+            self.size += message_size(message)
+            while len(entry.messages) > self.depth:
+                dropped = entry.messages.pop(0)
+                entry.size -= message_size(dropped)
+                self.size -= message_size(dropped)
+                entry.complete = False
+            self._evict()
+
+    def _remove(self, channel_id: int, message_id: int):
+        with self.lock:
+            self._bump(channel_id)
+            entry = self.entries.get(channel_id)
+            if entry is None:
+                return
+            for index, message in enumerate(entry.messages):
+                if message["id"] == message_id:
+                    del entry.messages[index]
+                    entry.size -= message_size(message)
+                    self.size -= message_size(message)
+                    break
+
+    def _bump(self, channel_id: int):
+        self.generations[channel_id] = self.generations.get(channel_id, 0) + 1
+
+    def _discard(self, channel_id: int):
+        entry = self.entries.pop(channel_id, None)
+        if entry is not None:
+            self.size -= entry.size
+
+    def _evict(self):
+        while self.size > self.max_bytes and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.stats["evictions"] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "channels": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self.stats,
+            }
+
+
+recent_messages = RecentMessagesCache(int(MESSAGE_CACHE_MB * 1024 * 1024), MESSAGE_CACHE_DEPTH)
+manager.add_listener(recent_messages.apply_event)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Optional, Tuple
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+from database import engine as default_engine
+from models import Message
+from read_markers import add_message_counts, mark_own_messages_read
+from change_log import log_changes
+
+logger = logging.getLogger("message_writer")
+
+# Milliseconds to collect new messages into one INSERT ... RETURNING; 0 writes each message on its own
+GROUP_COMMIT_MS = float(os.getenv("MESSAGE_GROUP_COMMIT_MS", "0"))
+# A batch this large is written at once without waiting for the window to close
+GROUP_COMMIT_MAX = int(os.getenv("MESSAGE_GROUP_COMMIT_MAX", "500"))
+
+Pending = Tuple[dict, asyncio.Future]
+
+
+class GroupCommitWriter:
+    """Write-behind stage for new messages: one transaction per window instead of per message.
+
+    Callers await write() and get back their own row (id and created_at
+    included) once the batch holding it has committed. Batches are written
+    on a single background thread, in arrival order, so the event loop never
+    blocks on the database and SQLite sees one writer.
+    """
+
+    def __init__(self, engine: Engine, window_ms: float, max_batch: int = GROUP_COMMIT_MAX):
+        self.engine = engine
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[Pending] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="message-writer")
+        self._flushes = set()
+        self.stats = {"messages": 0, "batches": 0, "fallbacks": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def write(self, values: dict) -> dict:
+        """values are Message columns; returns them with id and created_at as stored."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((values, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            # The window opens with the first message, so none waits longer than it
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._write_batch(batch))
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+
+    async def _write_batch(self, batch: List[Pending]):
+        loop = asyncio.get_running_loop()
+        values = [item for item, _ in batch]
+        try:
+            results = await loop.run_in_executor(self._executor, self._insert, values)
+        except Exception as e:
+            logger.error("Group commit of %d messages failed, retrying one by one: %s", len(batch), e)
+            self.stats["fallbacks"] += 1
+            results = await loop.run_in_executor(self._executor, self._insert_each, values)
+        self.stats["batches"] += 1
+        self.stats["messages"] += len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _insert(self, values: List[dict]) -> List[dict]:
+        # Runs on the writer thread; created_at is set here so RETURNING hands back the stored value
+        now = datetime.utcnow()
+        rows = [{"created_at": now, **item} for item in values]
+        statement = insert(Message).returning(Message.id, Message.created_at, sort_by_parameter_order=True)
+        with self.engine.begin() as conn:
+            returned = conn.execute(statement, rows).all()
+            add_message_counts(conn, [row["channel_id"] for row in rows])
+            log_changes(conn, "message", "create", [(row["channel_id"], stored.id) for row, stored in zip(rows, returned)])
+            mark_own_messages_read(conn, [(row["channel_id"], row["user_id"], stored.id) for row, stored in zip(rows, returned)])
+        return [{**row, "id": stored.id, "created_at": stored.created_at} for row, stored in zip(rows, returned)]
+
+    def _insert_each(self, values: List[dict]) -> list:
+        # One bad row (e.g. its channel was just deleted) must not fail the others
+        results = []
+        for item in values:
+            try:
+                results.extend(self._insert([item]))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    async def close(self):
+        self._flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        self._executor.shutdown(wait=False)
+
+
+message_writer = GroupCommitWriter(default_engine, GROUP_COMMIT_MS)
@@ -0,0 +1,324 @@
+"""Versioned schema migrations for SQLite and PostgreSQL.
+
+Each migration runs once, in its own transaction, and its version is
+recorded in schema_version. Fresh databases get their tables from
+Base.metadata.create_all first, so every migration has to be idempotent
+(IF NOT EXISTS, or check the schema before changing it).
+
+    python migrate.py            # apply pending migrations
+    python migrate.py --status   # print the current version
+"""
+import logging
+import sys
+from typing import Callable, List, Tuple
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from database import engine as default_engine
+
+logger = logging.getLogger("migrate")
+
+# Arbitrary key for pg_advisory_lock: workers starting together migrate one at a time
+PG_LOCK_KEY = 727_100_013
+
+Migration = Tuple[int, str, Callable[[Connection], None]]
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str):
+    def register(func: Callable[[Connection], None]):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def add_all_users_to_channel(conn: Connection, channel_id: int) -> int:
+    """Makes every user a member of the channel in one INSERT ... SELECT; returns how many were added."""
+    # Their read markers first, at the newest message, while the new members can still be told apart
+    conn.execute(text(
+        "INSERT INTO channel_reads (user_id, channel_id, last_read_message_id, read_count) "
+        "SELECT u.id, c.id, COALESCE("
+        "(SELECT MAX(id) FROM messages WHERE messages.channel_id = c.id), "
+        "(SELECT MAX(last_id) FROM archive_segments WHERE archive_segments.channel_id = c.id), 0), c.message_count "
+        "FROM users u JOIN channels c ON c.id = :channel_id "
+        "WHERE NOT EXISTS (SELECT 1 FROM channel_members cm WHERE cm.user_id = u.id AND cm.channel_id = :channel_id) "
+        "AND NOT EXISTS (SELECT 1 FROM channel_reads r WHERE r.user_id = u.id AND r.channel_id = :channel_id)"
+    ), {"channel_id": channel_id})
+    result = conn.execute(text(
+        "INSERT INTO channel_members (user_id, channel_id) "
+        "SELECT u.id, :channel_id FROM users u "
+        "WHERE NOT EXISTS (SELECT 1 FROM channel_members cm WHERE cm.user_id = u.id AND cm.channel_id = :channel_id)"
+    ), {"channel_id": channel_id})
+    return result.rowcount
+
+
+def add_missing_columns(conn: Connection, table: str, columns: dict):
+    existing = {column["name"] for column in inspect(conn).get_columns(table)}
+    for name, ddl_type in columns.items():
+        if name not in existing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+            logger.info("Added column %s.%s", table, name)
+
+
+# --- Migrations (append only; never edit one that has shipped) ---
+
+@migration(1, "Columns added by the old ad-hoc scripts")
+def legacy_columns(conn: Connection):
+    # Formerly migrations/add_image_url.py and add_verification_cols.py
+    add_missing_columns(conn, "messages", {"image_url": "VARCHAR", "thumbnail_url": "VARCHAR"})
+    add_missing_columns(conn, "users", {"pending_email": "VARCHAR", "verification_code": "VARCHAR"})
+
+
+@migration(2, "Hot-path indexes")
+def hot_path_indexes(conn: Connection):
+    # History pages: WHERE channel_id = ? AND id < ? ORDER BY id DESC
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_channel_id_id ON messages (channel_id, id)"))
+    # Members of a channel; (user_id, channel_id) is already the primary key
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_channel_members_channel_id_user_id ON channel_members (channel_id, user_id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_audit_logs_timestamp ON audit_logs (timestamp)"))
+
+
+# Text search configuration for Postgres; "russian" also stems Latin-script words as English
+PG_SEARCH_CONFIG = "russian"
+
+
+@migration(3, "Full-text index on message content")
+def message_search_index(conn: Connection):
+    if conn.dialect.name == "postgresql":
+        conn.execute(text(
+            "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{PG_SEARCH_CONFIG}', coalesce(content, ''))) STORED"
+        ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)"))
+        return
+    # SQLite: external-content FTS5 table over messages, kept in sync by triggers
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    create_search_triggers(conn)
+    # Index the messages written before the table existed
+    conn.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"))
+
+
+def create_search_triggers(conn: Connection):
+    """SQLite: the triggers that keep messages_fts in step with messages."""
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); END"
+    ))
+    conn.execute(text(
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN "
+        "INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content); "
+        "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END"
+    ))
+
+
+@migration(4, "Archive segments table")
+def archive_segments(conn: Connection):
+    id_column = "id SERIAL PRIMARY KEY" if conn.dialect.name == "postgresql" else "id INTEGER PRIMARY KEY"
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS archive_segments ("
+        f"{id_column}, "
+        "channel_id INTEGER, "
+        "first_id INTEGER, "
+        "last_id INTEGER, "
+        "message_count INTEGER, "
+        "path VARCHAR, "
+        "created_at TIMESTAMP)"
+    ))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_archive_segments_channel_id ON archive_segments (channel_id)"))
+
+
+@migration(5, "Message counters and read markers")
+def read_markers(conn: Connection):
+    add_missing_columns(conn, "channels", {"message_count": "INTEGER NOT NULL DEFAULT 0"})
+    conn.execute(text(
+        "UPDATE channels SET message_count = "
+        "(SELECT COUNT(*) FROM messages WHERE messages.channel_id = channels.id) + "
+        "(SELECT COALESCE(SUM(message_count), 0) FROM archive_segments WHERE archive_segments.channel_id = channels.id)"
+    ))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS channel_reads ("
+        "user_id INTEGER NOT NULL REFERENCES users (id), "
+        "channel_id INTEGER NOT NULL REFERENCES channels (id), "
+        "last_read_message_id INTEGER NOT NULL DEFAULT 0, "
+        "read_count INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (user_id, channel_id))"
+    ))
+    # Existing members start with everything read rather than their whole history unread
+    conn.execute(text(
+        "INSERT INTO channel_reads (user_id, channel_id, last_read_message_id, read_count) "
+        "SELECT cm.user_id, cm.channel_id, "
+        "COALESCE((SELECT MAX(id) FROM messages WHERE messages.channel_id = cm.channel_id), 0), c.message_count "
+        "FROM channel_members cm JOIN channels c ON c.id = cm.channel_id "
+        "WHERE NOT EXISTS (SELECT 1 FROM channel_reads r WHERE r.user_id = cm.user_id AND r.channel_id = cm.channel_id)"
+    ))
+
+
+
+@migration(6, "Change log for delta sync")
+def change_log(conn: Connection):
+    id_column = "id SERIAL PRIMARY KEY" if conn.dialect.name == "postgresql" else "id INTEGER PRIMARY KEY"
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS change_log ("
+        f"{id_column}, "
+        "kind VARCHAR NOT NULL, "
+        "op VARCHAR NOT NULL, "
+        "channel_id INTEGER, "
+        "entity_id INTEGER, "
+        "created_at TIMESTAMP)"
+    ))
+
+
+@migration(7, "Everyone in the default channel")
+def default_channel_members(conn: Connection):
+    # Formerly a per-user loop on every startup; new users are added when they are created
+    channel_id = conn.execute(text("SELECT id FROM channels WHERE name = :name"), {"name": "Общий"}).scalar()
+    if channel_id is not None:
+        added = add_all_users_to_channel(conn, channel_id)
+        if added:
+            logger.info("Added %d users to the default channel", added)
+
+
+
+def uses_autoincrement(conn: Connection, table: str) -> bool:
+    sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table}).scalar()
+    return "AUTOINCREMENT" in (sql or "").upper()
+
+
+def raise_sqlite_sequence(conn: Connection, table: str, floor_sql: str):
+    """Makes the table's next AUTOINCREMENT id larger than floor_sql (a scalar query) as well."""
+    conn.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT :name, 0 "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"
+    ), {"name": table})
+    conn.execute(text(f"UPDATE sqlite_sequence SET seq = MAX(seq, COALESCE(({floor_sql}), 0)) WHERE name = :name"), {"name": table})
+
+
+@migration(8, "Message ids are never reused")
+def message_autoincrement(conn: Connection):
+    # SQLite hands out max(id) + 1, so once the newest messages were archived (or
+    # deleted) their ids came back and collided with the archive. Postgres
+    # sequences never go back.
+    if conn.dialect.name != "sqlite" or uses_autoincrement(conn, "messages"):
+        return
+    columns = "id, channel_id, user_id, content, image_url, thumbnail_url, created_at"
+    conn.execute(text(
+        "CREATE TABLE messages_autoincrement ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "channel_id INTEGER REFERENCES channels (id), "
+        "user_id INTEGER REFERENCES users (id), "
+        "content TEXT, "
+        "image_url VARCHAR, "
+        "thumbnail_url VARCHAR, "
+        "created_at DATETIME)"
+    ))
+    conn.execute(text(f"INSERT INTO messages_autoincrement ({columns}) SELECT {columns} FROM messages"))
+    # Takes the indexes and search triggers with it; messages_fts keeps its rows, ids are unchanged
+    conn.execute(text("DROP TABLE messages"))
+    conn.execute(text("ALTER TABLE messages_autoincrement RENAME TO messages"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_id ON messages (id)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_channel_id_id ON messages (channel_id, id)"))
+    create_search_triggers(conn)
+    # Ids already handed to the archive stay taken even when no hot row is above them
+    raise_sqlite_sequence(conn, "messages", "SELECT MAX(last_id) FROM archive_segments")
+
+
+
+@migration(9, "Change log versions in commit order")
+def change_log_versions(conn: Connection):
+    pruned = "SELECT CAST(value AS INTEGER) FROM system_settings WHERE key = 'change_log_pruned_through'"
+    if conn.dialect.name == "sqlite":
+        if not uses_autoincrement(conn, "change_log"):
+            # Pruning every row used to let ids (then the versions) start over below pruned_through
+            columns = "id, kind, op, channel_id, entity_id, created_at"
+            conn.execute(text(
+                "CREATE TABLE change_log_autoincrement ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "version BIGINT, "
+                "kind VARCHAR NOT NULL, "
+                "op VARCHAR NOT NULL, "
+                "channel_id INTEGER, "
+                "entity_id INTEGER, "
+                "created_at TIMESTAMP)"
+            ))
+            conn.execute(text(f"INSERT INTO change_log_autoincrement ({columns}) SELECT {columns} FROM change_log"))
+            conn.execute(text("DROP TABLE change_log"))
+            conn.execute(text("ALTER TABLE change_log_autoincrement RENAME TO change_log"))
+        raise_sqlite_sequence(conn, "change_log", pruned)
+    else:
+        add_missing_columns(conn, "change_log", {"version": "BIGINT"})
+    # Rows written so far keep their id as their version, which is what clients already hold
+    conn.execute(text("UPDATE change_log SET version = id WHERE version IS NULL"))
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("CREATE SEQUENCE IF NOT EXISTS change_log_version_seq"))
+        conn.execute(text(
+            "SELECT setval('change_log_version_seq', GREATEST("
+            f"(SELECT COALESCE(MAX(version), 0) FROM change_log), COALESCE(({pruned}), 0), "
+            "(SELECT last_value FROM change_log_version_seq), 1))"
+        ))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_change_log_version ON change_log (version)"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_change_log_unversioned ON change_log (id) WHERE version IS NULL"))
+
+
+# --- Runner ---
+
+def ensure_version_table(conn: Connection):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR NOT NULL, "
+        "applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+
+def run_migrations(engine: Engine = default_engine) -> List[int]:
+    """Applies every pending migration in version order and returns the versions applied."""
+    applied = []
+    postgres = engine.dialect.name == "postgresql"
+    with engine.connect() as conn:
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": PG_LOCK_KEY})
+            conn.commit()
+        try:
+            with conn.begin():
+                ensure_version_table(conn)
+            for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+                with conn.begin():
+                    # Re-read inside the transaction: another worker may have just applied it
+                    if version <= current_version(conn):
+                        continue
+                    logger.info("Applying migration %d: %s", version, description)
+                    func(conn)
+                    conn.execute(
+                        text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+                        {"version": version, "description": description},
+                    )
+                applied.append(version)
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PG_LOCK_KEY})
+                conn.commit()
+    return applied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if "--status" in sys.argv:
+        with default_engine.begin() as conn:
+            ensure_version_table(conn)
+            print(f"Schema version: {current_version(conn)} (latest: {max(m[0] for m in MIGRATIONS)})")
+    else:
+        from database import Base
+        import models  # noqa: F401 (registers the tables)
+        Base.metadata.create_all(bind=default_engine)
+        applied = run_migrations()
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Table
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Index, Integer, Sequence, String, Text, DateTime, Table
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -8,7 +8,9 @@ channel_members = Table(
     "channel_members",
     Base.metadata,
     Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
-    Column("channel_id", Integer, ForeignKey("channels.id"), primary_key=True)
+    Column("channel_id", Integer, ForeignKey("channels.id"), primary_key=True),
+    # The primary key covers lookups by user; this one covers "members of a channel"
+    Index("ix_channel_members_channel_id_user_id", "channel_id", "user_id")
 )
 
 class User(Base):
@@ -27,6 +29,7 @@ class User(Base):
     created_channels = relationship("Channel", back_populates="creator")
     audit_logs = relationship("AuditLog", back_populates="user")
     channels = relationship("Channel", secondary=channel_members, back_populates="members")
+    reads = relationship("ChannelRead", cascade="all, delete")
 
 class SystemSetting(Base):
     __tablename__ = "system_settings"
@@ -41,9 +44,12 @@ class Channel(Base):
     name = Column(String, unique=True, index=True)
     created_by = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Messages ever posted and still kept (archived ones included); see read_markers.py
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     creator = relationship("User", back_populates="created_channels")
     messages = relationship("Message", back_populates="channel", cascade="all, delete")
+    reads = relationship("ChannelRead", cascade="all, delete")
     members = relationship("User", secondary=channel_members, back_populates="channels")
 
 class Message(Base):
@@ -60,6 +66,60 @@ class Message(Base):
     channel = relationship("Channel", back_populates="messages")
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        # History pages seek by (channel_id, id) instead of scanning the channel
+        Index("ix_messages_channel_id_id", "channel_id", "id"),
+        # Archived ids must never be handed out again (SQLite reuses max(id) + 1 otherwise)
+        {"sqlite_autoincrement": True},
+    )
+
+class ChannelRead(Base):
+    # How far a user has read a channel: unread = channel.message_count - read_count
+    __tablename__ = "channel_reads"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    channel_id = Column(Integer, ForeignKey("channels.id"), primary_key=True)
+    last_read_message_id = Column(Integer, nullable=False, default=0)
+    # channel.message_count as of last_read_message_id
+    read_count = Column(Integer, nullable=False, default=0)
+
+class ChangeLog(Base):
+    # One row per create/delete that clients sync (see change_log.py)
+    __tablename__ = "change_log"
+
+    id = Column(Integer, primary_key=True)
+    # Set once the row is committed, in commit order; NULL until then (see change_log.assign_versions)
+    version = Column(BigInteger, nullable=True)
+    kind = Column(String, nullable=False)  # message | channel | member
+    op = Column(String, nullable=False)  # create | delete
+    channel_id = Column(Integer)
+    # The message id, or the user id of a membership change
+    entity_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_change_log_version", "version", unique=True),
+        # Rows still waiting for a version; stays tiny
+        Index("ix_change_log_unversioned", "id", sqlite_where=version.is_(None), postgresql_where=version.is_(None)),
+        # Pruned ids must not come back as new rows (SQLite reuses max(id) + 1 otherwise)
+        {"sqlite_autoincrement": True},
+    )
+
+# PostgreSQL hands out change_log versions from this; create_all skips it on SQLite
+change_log_versions = Sequence("change_log_version_seq", metadata=Base.metadata)
+
+class ArchiveSegment(Base):
+    # One compressed file of a channel's archived messages (see archive.py)
+    __tablename__ = "archive_segments"
+
+    id = Column(Integer, primary_key=True, index=True)
+    channel_id = Column(Integer, index=True)
+    first_id = Column(Integer)
+    last_id = Column(Integer)
+    message_count = Column(Integer)
+    path = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class AuditLog(Base):
     __tablename__ = "audit_logs"
 
@@ -67,6 +127,6 @@ class AuditLog(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     action = Column(String)
     details = Column(Text)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="audit_logs")
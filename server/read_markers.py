@@ -0,0 +1,148 @@
+"""Read markers and unread counts.
+
+Every channel carries a running message_count, bumped in the same
+transaction as each insert (and dropped on delete). A user's marker
+stores the last message they read and what message_count was at that
+point, so unread = message_count - read_count: one row per channel, no
+matter how much history is behind or ahead of the marker. Members get a
+marker at the newest message when they join, and authors have read what
+they post.
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from models import ArchiveSegment, Channel, ChannelRead, Message
+from archive import cold_store
+
+
+def add_message_counts(conn: Connection, channel_ids: Iterable[int]):
+    """Adds newly inserted messages (one channel id each) to their channels' counters, in the caller's transaction."""
+    counts = Counter(channel_ids)
+    if not counts:
+        return
+    statement = update(Channel).where(Channel.id == bindparam("counted_channel")).values(
+        message_count=Channel.message_count + bindparam("added")
+    )
+    conn.execute(statement, [{"counted_channel": channel_id, "added": added} for channel_id, added in counts.items()])
+
+
+def add_history_counts(conn: Connection, channel_ids: Iterable[int]):
+    """add_message_counts for imported history: members who had read everything stay caught up."""
+    counts = Counter(channel_ids)
+    if not counts:
+        return
+    add_message_counts(conn, counts.elements())
+    count_now = select(Channel.message_count).where(Channel.id == bindparam("counted_channel")).scalar_subquery()
+    newest = select(func.max(Message.id)).where(Message.channel_id == bindparam("counted_channel")).scalar_subquery()
+    statement = update(ChannelRead).where(
+        ChannelRead.channel_id == bindparam("counted_channel"),
+        ChannelRead.read_count == count_now - bindparam("added"),
+    ).values(read_count=ChannelRead.read_count + bindparam("added"), last_read_message_id=newest)
+    conn.execute(statement, [{"counted_channel": channel_id, "added": added} for channel_id, added in counts.items()])
+
+
+def mark_members_read(conn: Connection, channel_id: int, user_ids: Iterable[int]):
+    """New members start at the newest message, like the members migration 5 found; in the caller's transaction."""
+    newest = (
+        conn.execute(select(func.max(Message.id)).where(Message.channel_id == channel_id)).scalar()
+        or conn.execute(select(func.max(ArchiveSegment.last_id)).where(ArchiveSegment.channel_id == channel_id)).scalar()
+        or 0
+    )
+    read_count = conn.execute(select(Channel.message_count).where(Channel.id == channel_id)).scalar() or 0
+    save_markers(conn, [
+        {"user_id": user_id, "channel_id": channel_id, "last_read_message_id": newest, "read_count": read_count}
+        for user_id in user_ids
+    ])
+
+
+def mark_own_messages_read(conn: Connection, messages: List[Tuple[int, Optional[int], int]]):
+    """Moves each author's marker to their new message: (channel_id, user_id, message_id), already counted."""
+    channel_ids = {channel_id for channel_id, _, _ in messages}
+    counts = dict(conn.execute(select(Channel.id, Channel.message_count).where(Channel.id.in_(channel_ids))).all())
+    markers = {}
+    # Newest first: an author's last message in the batch wins, and message_count is rewound to each message
+    for channel_id, user_id, message_id in reversed(messages):
+        if user_id is not None:
+            markers.setdefault((user_id, channel_id), {
+                "user_id": user_id, "channel_id": channel_id, "last_read_message_id": message_id, "read_count": counts[channel_id],
+            })
+        counts[channel_id] -= 1
+    save_markers(conn, list(markers.values()))
+
+
+def save_markers(conn: Connection, rows: List[dict]):
+    """Inserts markers or moves existing ones forward; a marker is never moved back."""
+    if not rows:
+        return
+    dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(ChannelRead)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ChannelRead.user_id, ChannelRead.channel_id],
+        set_={"last_read_message_id": statement.excluded.last_read_message_id, "read_count": statement.excluded.read_count},
+        where=ChannelRead.last_read_message_id <= statement.excluded.last_read_message_id,
+    )
+    conn.execute(statement, rows)
+
+
+def message_removed(db: Session, channel_id: int, message_id: int):
+    """Uncounts a message about to be deleted, also from the markers of everyone who had read it."""
+    db.query(Channel).filter(Channel.id == channel_id).update(
+        {Channel.message_count: Channel.message_count - 1}, synchronize_session=False
+    )
+    db.query(ChannelRead).filter(
+        ChannelRead.channel_id == channel_id, ChannelRead.last_read_message_id >= message_id
+    ).update({ChannelRead.read_count: ChannelRead.read_count - 1}, synchronize_session=False)
+
+
+def unread_counts(db: Session, user_id: int, channels: List[Channel]) -> Dict[int, dict]:
+    """{channel_id: {"unread_count", "last_read_message_id"}} for the given channels, in one query."""
+    markers = {
+        marker.channel_id: marker
+        for marker in db.query(ChannelRead).filter(
+            ChannelRead.user_id == user_id, ChannelRead.channel_id.in_([channel.id for channel in channels])
+        )
+    }
+    result = {}
+    for channel in channels:
+        marker = markers.get(channel.id)
+        read_count = marker.read_count if marker else 0
+        result[channel.id] = {
+            "unread_count": max(0, (channel.message_count or 0) - read_count),
+            "last_read_message_id": marker.last_read_message_id if marker else None,
+        }
+    return result
+
+
+def mark_read(db: Session, user_id: int, channel: Channel, message_id: Optional[int]) -> dict:
+    """Moves the user's marker forward to message_id (the newest message when None) and commits."""
+    newest = db.query(func.max(Message.id)).filter(Message.channel_id == channel.id).scalar() or cold_store.boundary(db, channel.id)
+    marker = db.get(ChannelRead, (user_id, channel.id))
+    if marker is None:
+        marker = ChannelRead(user_id=user_id, channel_id=channel.id, last_read_message_id=0, read_count=0)
+        db.add(marker)
+
+    if message_id is None or message_id >= newest:
+        message_id, read_count = newest, channel.message_count
+    else:
+        # Only the messages after it are counted: the short unread tail, not the history before it
+        newer = db.query(func.count(Message.id)).filter(
+            Message.channel_id == channel.id, Message.id > message_id
+        ).scalar()
+        if message_id < cold_store.boundary(db, channel.id):
+            # The tail starts in the archive
+            newer += cold_store.count_after(db, channel.id, message_id)
+        read_count = channel.message_count - newer
+
+    # Markers never move back, so a stale tab cannot bring read messages back as unread
+    if message_id >= marker.last_read_message_id:
+        marker.last_read_message_id = message_id
+        marker.read_count = read_count
+    db.commit()
+    return {
+        "channel_id": channel.id,
+        "last_read_message_id": marker.last_read_message_id,
+        "unread_count": max(0, channel.message_count - marker.read_count),
+    }
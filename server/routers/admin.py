@@ -1,13 +1,22 @@
 from typing import List
 import secrets
 import string
-from fastapi import APIRouter, Depends, HTTPException, status
+import zlib
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from database import get_db
-from models import User, Channel, AuditLog
+from database import get_db, engine
+from models import User, Channel, AuditLog, channel_members
 from schemas import UserCreate, User as UserSchema, ChannelCreate, Channel as ChannelSchema, UserUpdateAdmin
 from auth_dependencies import get_current_admin, get_password_hash
 from email_service import send_password_reset_email
+from connection_manager import manager
+from message_cache import recent_messages
+from archive import cold_store
+from bulk_import import BulkImporter
+from change_log import log_changes
+from read_markers import mark_members_read
+from channel_access import channel_access
 
 router = APIRouter(
     prefix="/admin",
@@ -30,7 +39,10 @@ def create_user(user: UserCreate, db: Session = Depends(get_db), admin: User = D
     # Auto-add to "Общий" channel
     default_channel = db.query(Channel).filter(Channel.name == "Общий").first()
     if default_channel:
-        default_channel.members.append(new_user)
+        db.flush()
+        db.execute(channel_members.insert().values(channel_id=default_channel.id, user_id=new_user.id))
+        log_changes(db.connection(), "member", "create", [(default_channel.id, new_user.id)])
+        mark_members_read(db.connection(), default_channel.id, [new_user.id])
     
     # Audit Log
     log = AuditLog(user_id=admin.id, action="CREATE_USER", details=f"Created user {user.username}")
@@ -48,12 +60,16 @@ def delete_user(user_id: int, db: Session = Depends(get_db), admin: User = Depen
     if user.id == admin.id:
         raise HTTPException(status_code=400, detail="Нельзя удалить самого себя")
         
+    log_changes(db.connection(), "member", "delete", [(channel.id, user.id) for channel in user.channels])
     db.delete(user)
     
     log = AuditLog(user_id=admin.id, action="DELETE_USER", details=f"Deleted user id {user_id}")
     db.add(log)
     
     db.commit()
+    # Their messages lose the author without a per-message event
+    manager.publish({"op": "invalidate_messages"})
+    manager.drop_user(user_id)
     return {"detail": "Пользователь удален"}
 
 @router.get("/users", response_model=List[UserSchema])
@@ -72,6 +88,7 @@ def update_user(user_id: int, user_update: UserUpdateAdmin, db: Session = Depend
         # Admin override: clear any pending verification
         db_user.pending_email = None
         db_user.verification_code = None
+    rights_changed = user_update.is_admin is not None and user_update.is_admin != db_user.is_admin
     if user_update.is_admin is not None:
         if db_user.id == admin.id and user_update.is_admin is False:
              raise HTTPException(status_code=400, detail="Нельзя снять права администратора с самого себя")
@@ -79,6 +96,9 @@ def update_user(user_id: int, user_update: UserUpdateAdmin, db: Session = Depend
         
     db.commit()
     db.refresh(db_user)
+    if rights_changed:
+        # Open sockets still carry the old is_admin
+        manager.refresh_user(db_user.id)
     
     log = AuditLog(user_id=admin.id, action="UPDATE_USER", details=f"Updated user {db_user.username}")
     db.add(log)
@@ -128,13 +148,57 @@ def delete_channel(channel_id: int, db: Session = Depends(get_db), admin: User =
         raise HTTPException(status_code=400, detail="Нельзя удалить основной канал")
     
     db.delete(channel)
+    cold_store.drop_channel(db, channel_id)
+    log_changes(db.connection(), "channel", "delete", [(channel_id, None)])
     
     log = AuditLog(user_id=admin.id, action="DELETE_CHANNEL", details=f"Deleted channel {channel.name}")
     db.add(log)
     
     db.commit()
+    
+    manager.broadcast_to_channel(channel_id, {"type": "channel_deleted", "id": channel_id})
+    manager.drop_channel(channel_id)
     return {"detail": "Канал удален"}
 
+# --- BULK IMPORT (ADMIN) ---
+
+@router.post("/import")
+async def import_data(request: Request, db: Session = Depends(get_db), admin: User = Depends(get_current_admin)):
+    """Loads an NDJSON export (optionally gzipped) streamed in the request body; see bulk_import.py."""
+    importer = BulkImporter(engine, admin.id)
+    gzipped = request.headers.get("content-encoding") == "gzip" or request.headers.get("content-type") == "application/gzip"
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16) if gzipped else None
+    tail = b""
+    async for chunk in request.stream():
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+        if lines:
+            # Database work stays off the event loop; the body is read on as each chunk is written
+            await run_in_threadpool(lambda: [importer.feed_line(line) for line in lines])
+    if decompressor:
+        tail += decompressor.flush()
+    summary = await run_in_threadpool(lambda: (importer.feed_line(tail), importer.finish())[1])
+
+    log = AuditLog(user_id=admin.id, action="IMPORT", details=f"Imported {summary['users']} users, {summary['channels']} channels, {summary['messages']} messages")
+    await run_in_threadpool(lambda: (db.add(log), db.commit()))
+    # Imported history never went through the per-message events
+    manager.publish({"op": "invalidate_messages"})
+    # Memberships were written without subscribe events
+    manager.publish({"op": "invalidate_access"})
+    return summary
+
+# --- WEBSOCKET STATS (ADMIN) ---
+
+@router.get("/ws/stats")
+def get_ws_stats():
+    return manager.snapshot()
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    return {**recent_messages.snapshot(), "access": channel_access.snapshot()}
+
 # --- SYSTEM SETTINGS (ADMIN) ---
 
 from schemas import SMTPSettings, SystemSetting as SystemSettingSchema
@@ -1,45 +1,153 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import Session
-from database import get_db
-from models import User, Channel, Message
-from schemas import ChannelCreate, Channel as ChannelSchema, MessageCreate, Message as MessageSchema, MemberAdd
-from auth_dependencies import get_current_user
+from database import get_db, SessionLocal
+from models import User, Channel, Message, channel_members
+from schemas import ChannelCreate, Channel as ChannelSchema, ChannelSummary, MessageCreate, Message as MessageSchema, MessagePage, MemberAdd, MemberPage, MembersBulk, MembersBulkResult, ReadMarker
+from auth_dependencies import get_current_user, get_user_from_token
+from channel_access import can_access_channel, is_member
+from connection_manager import Connection, manager
+from message_cache import recent_messages, slice_page
+from message_writer import message_writer
+from archive import cold_store
+from read_markers import add_message_counts, mark_members_read, mark_own_messages_read, mark_read, message_removed, unread_counts
+from change_log import log_changes
+from bulk_import import insert_ignore
+import json_codec
 
 router = APIRouter(
     tags=["chat"]
 )
 
-# --- WEB SOCKET MANAGER ---
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+MEMBERS_PAGE_SIZE = 50
+MEMBERS_MAX_PAGE_SIZE = 200
+# Users one members:bulk request may name
+MEMBERS_BULK_MAX = 5000
+CHANNEL_PREVIEW_CHARS = 120
 
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+def query_message_rows(db: Session):
+    """Messages as plain rows with the author's username, in one joined query.
 
-    def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+    Selects only what MessageSchema needs, so no ORM objects are built and
+    no per-author lazy load happens. Rows turn into dicts with row._asdict().
+    """
+    return db.query(
+        Message.id,
+        Message.channel_id,
+        Message.user_id,
+        Message.content,
+        Message.image_url,
+        Message.thumbnail_url,
+        Message.created_at,
+        User.username,
+    ).outerjoin(User, User.id == Message.user_id)
 
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+def read_before(db: Session, channel_id: int, before_id: Optional[int], count: int) -> List[dict]:
+    """Up to count messages with id < before_id (all when None), newest first, hot rows then the archive."""
+    query = query_message_rows(db).filter(Message.channel_id == channel_id)
+    if before_id is not None:
+        query = query.filter(Message.id < before_id)
+    messages = [row._asdict() for row in query.order_by(Message.id.desc()).limit(count).all()]
+    if len(messages) < count:
+        # Ran out of hot rows: older history may be in cold storage
+        oldest = messages[-1]["id"] if messages else before_id
+        messages.extend(cold_store.read_before(db, channel_id, oldest, count - len(messages)))
+    return messages
+
+def read_after(db: Session, channel_id: int, after_id: int, count: int) -> List[dict]:
+    """Up to count messages with id > after_id, oldest first, the archive then hot rows."""
+    messages = []
+    if after_id < cold_store.boundary(db, channel_id):
+        messages = cold_store.read_after(db, channel_id, after_id, count)
+    if len(messages) < count:
+        start = messages[-1]["id"] if messages else after_id
+        rows = query_message_rows(db).filter(
+            Message.channel_id == channel_id, Message.id > start
+        ).order_by(Message.id.asc()).limit(count - len(messages)).all()
+        messages.extend(row._asdict() for row in rows)
+    return messages
 
-manager = ConnectionManager()
+def get_accessible_channel_ids(db: Session, user: User) -> List[int]:
+    # Same visibility rule as get_channels below
+    query = db.query(Channel.id)
+    if not user.is_admin:
+        query = query.filter((Channel.created_by == user.id) | (Channel.members.contains(user)))
+    return [channel_id for (channel_id,) in query.all()]
 
 # --- CHANNELS ---
 
-@router.get("/channels", response_model=List[ChannelSchema])
+def last_message_previews(db: Session, channels: list) -> dict:
+    """{channel_id: preview} of each channel's newest message, by the ids already picked per channel."""
+    ids = [channel.last_message_id for channel in channels if channel.last_message_id]
+    messages = {row.channel_id: row._asdict() for row in query_message_rows(db).filter(Message.id.in_(ids))} if ids else {}
+    for channel in channels:
+        if channel.id not in messages and channel.message_count:
+            # Everything left is archived
+            cold = cold_store.read_before(db, channel.id, None, 1)
+            if cold:
+                messages[channel.id] = cold[0]
+    return {
+        channel_id: {**message, "content": (message["content"] or "")[:CHANNEL_PREVIEW_CHARS]}
+        for channel_id, message in messages.items()
+    }
+
+@router.get("/channels", response_model=List[ChannelSummary])
 def get_channels(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if current_user.is_admin:
-        return db.query(Channel).all()
-    
-    # Return channels where user is owner or member
-    return db.query(Channel).filter(
-        (Channel.created_by == current_user.id) | 
-        (Channel.members.contains(current_user))
-    ).all()
+    """Channel summaries in a fixed number of queries: no member rows are loaded or sent."""
+    member_count = select(func.count()).select_from(channel_members).where(
+        channel_members.c.channel_id == Channel.id
+    ).correlate(Channel).scalar_subquery()
+    # One index seek per channel, rather than MAX(id) grouped over all messages
+    last_message_id = select(Message.id).where(
+        Message.channel_id == Channel.id
+    ).order_by(Message.id.desc()).limit(1).correlate(Channel).scalar_subquery()
+
+    query = db.query(
+        Channel.id, Channel.name, Channel.created_by, Channel.created_at, Channel.message_count,
+        member_count.label("member_count"), last_message_id.label("last_message_id"),
+    )
+    if not current_user.is_admin:
+        # Return channels where user is owner or member
+        query = query.filter(
+            (Channel.created_by == current_user.id) | 
+            (Channel.members.contains(current_user))
+        )
+    channels = query.order_by(Channel.id).all()
+
+    # One marker lookup for the whole list; the counts themselves are kept up to date on write
+    unread = unread_counts(db, current_user.id, channels)
+    previews = last_message_previews(db, channels)
+    return [
+        {
+            "id": channel.id,
+            "name": channel.name,
+            "created_by": channel.created_by,
+            "created_at": channel.created_at,
+            "member_count": channel.member_count,
+            "last_message": previews.get(channel.id),
+            **unread[channel.id],
+        }
+        for channel in channels
+    ]
+
+@router.post("/channels/{channel_id}/read")
+def read_channel(channel_id: int, marker: Optional[ReadMarker] = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Advances the user's read marker; their other tabs and devices are told the new unread count."""
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+
+    if not can_access_channel(db, current_user, channel):
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+
+    result = mark_read(db, current_user.id, channel, marker.message_id if marker else None)
+    manager.send_to_user(current_user.id, {"type": "channel_read", **result})
+    return result
 
 @router.post("/channels", response_model=ChannelSchema)
 def create_channel(channel: ChannelCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
@@ -52,8 +160,12 @@ def create_channel(channel: ChannelCreate, db: Session = Depends(get_db), curren
     new_channel.members.append(current_user)
     
     db.add(new_channel)
+    db.flush()
+    log_changes(db.connection(), "channel", "create", [(new_channel.id, None)])
+    log_changes(db.connection(), "member", "create", [(new_channel.id, current_user.id)])
     db.commit()
     db.refresh(new_channel)
+    manager.subscribe(current_user.id, new_channel.id)
     
     return new_channel
 
@@ -71,15 +183,42 @@ def delete_channel(channel_id: int, db: Session = Depends(get_db), current_user:
         raise HTTPException(status_code=403, detail="Вы можете удалять только созданные вами каналы")
     
     db.delete(channel)
+    cold_store.drop_channel(db, channel_id)
+    log_changes(db.connection(), "channel", "delete", [(channel_id, None)])
     db.commit()
     
-    import asyncio
-    asyncio.create_task(manager.broadcast({"type": "channel_deleted", "id": channel_id}))
+    manager.broadcast_to_channel(channel_id, {"type": "channel_deleted", "id": channel_id})
+    manager.drop_channel(channel_id)
     
     return {"detail": "Канал удален"}
 
 # --- MEMBER MANAGEMENT ---
 
+@router.get("/channels/{channel_id}/members", response_model=MemberPage)
+def get_members(
+    channel_id: int,
+    after_id: Optional[int] = None,
+    limit: int = Query(MEMBERS_PAGE_SIZE, ge=1, le=MEMBERS_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+
+    if not can_access_channel(db, current_user, channel):
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+
+    query = db.query(User).join(channel_members, channel_members.c.user_id == User.id).filter(
+        channel_members.c.channel_id == channel_id
+    )
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    users = query.order_by(User.id.asc()).limit(limit + 1).all()
+    has_more = len(users) > limit
+    users = users[:limit]
+    return {"items": users, "has_more": has_more, "next_cursor": users[-1].id if has_more else None}
+
 @router.post("/channels/{channel_id}/members")
 def add_member(channel_id: int, member_data: MemberAdd, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     channel = db.query(Channel).filter(Channel.id == channel_id).first()
@@ -93,11 +232,16 @@ def add_member(channel_id: int, member_data: MemberAdd, db: Session = Depends(ge
     if not user_to_add:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     
-    if user_to_add in channel.members:
+    if is_member(db, user_to_add.id, channel_id):
         return {"detail": "Пользователь уже является участником"}
     
-    channel.members.append(user_to_add)
+    # A plain row insert: appending to channel.members would load the whole roster first
+    db.execute(channel_members.insert().values(channel_id=channel_id, user_id=user_to_add.id))
+    log_changes(db.connection(), "member", "create", [(channel_id, user_to_add.id)])
+    mark_members_read(db.connection(), channel_id, [user_to_add.id])
     db.commit()
+    manager.subscribe(user_to_add.id, channel_id)
+    manager.send_to_user(user_to_add.id, {"type": "channel_added", "id": channel_id})
     return {"detail": f"Пользователь {user_to_add.username} добавлен"}
 
 @router.delete("/channels/{channel_id}/members/{user_id}")
@@ -116,88 +260,304 @@ def remove_member(channel_id: int, user_id: int, db: Session = Depends(get_db),
     if user_to_remove.id == channel.created_by:
         raise HTTPException(status_code=400, detail="Нельзя удалить автора канала")
     
-    if user_to_remove in channel.members:
-        channel.members.remove(user_to_remove)
+    if is_member(db, user_to_remove.id, channel_id):
+        db.execute(channel_members.delete().where(
+            channel_members.c.channel_id == channel_id, channel_members.c.user_id == user_to_remove.id
+        ))
+        log_changes(db.connection(), "member", "delete", [(channel_id, user_to_remove.id)])
         db.commit()
+        manager.unsubscribe(user_to_remove.id, channel_id)
+        manager.send_to_user(user_to_remove.id, {"type": "channel_removed", "id": channel_id})
     
     return {"detail": "Участник удален"}
 
+def owned_channel(db: Session, channel_id: int, current_user: User, detail: str) -> Channel:
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+    if channel.created_by != current_user.id and not current_user.is_admin:
+        raise HTTPException(status_code=403, detail=detail)
+    return channel
+
+def resolve_users(db: Session, body: MembersBulk) -> tuple:
+    """(user ids, names and ids that match nobody) for the usernames and ids in the body, in one query."""
+    usernames, user_ids = set(body.usernames), set(body.user_ids)
+    if len(usernames) + len(user_ids) > MEMBERS_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"Не больше {MEMBERS_BULK_MAX} пользователей за один запрос")
+    rows = db.query(User.id, User.username).filter(
+        or_(User.username.in_(usernames), User.id.in_(user_ids))
+    ).all()
+    not_found = sorted(usernames - {row.username for row in rows}) + [
+        str(user_id) for user_id in sorted(user_ids - {row.id for row in rows})
+    ]
+    return sorted({row.id for row in rows}), not_found
+
+@router.post("/channels/{channel_id}/members:bulk", response_model=MembersBulkResult)
+def add_members_bulk(channel_id: int, body: MembersBulk, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Adds many users at once; ones already in the channel are left as they are."""
+    owned_channel(db, channel_id, current_user, "Только автор канала может добавлять участников")
+    user_ids, not_found = resolve_users(db, body)
+    added = []
+    if user_ids:
+        # Existing rows are skipped by the database; RETURNING gives back only the new ones
+        statement = insert_ignore(channel_members, db.get_bind().dialect.name).returning(channel_members.c.user_id)
+        added = db.execute(statement, [{"channel_id": channel_id, "user_id": user_id} for user_id in user_ids]).scalars().all()
+    if added:
+        log_changes(db.connection(), "member", "create", [(channel_id, user_id) for user_id in added])
+        mark_members_read(db.connection(), channel_id, added)
+        db.commit()
+        manager.change_members(channel_id, added=added)
+    return {"user_ids": sorted(added), "unchanged": sorted(set(user_ids) - set(added)), "not_found": not_found}
+
+@router.delete("/channels/{channel_id}/members:bulk", response_model=MembersBulkResult)
+def remove_members_bulk(channel_id: int, body: MembersBulk, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Removes many users at once; ones not in the channel are left as they are."""
+    channel = owned_channel(db, channel_id, current_user, "Только автор канала может удалять участников")
+    user_ids, not_found = resolve_users(db, body)
+    if channel.created_by in user_ids:
+        raise HTTPException(status_code=400, detail="Нельзя удалить автора канала")
+    removed = []
+    if user_ids:
+        removed = db.execute(channel_members.delete().where(
+            channel_members.c.channel_id == channel_id, channel_members.c.user_id.in_(user_ids)
+        ).returning(channel_members.c.user_id)).scalars().all()
+    if removed:
+        log_changes(db.connection(), "member", "delete", [(channel_id, user_id) for user_id in removed])
+        db.commit()
+        manager.change_members(channel_id, removed=removed)
+    return {"user_ids": sorted(removed), "unchanged": sorted(set(user_ids) - set(removed)), "not_found": not_found}
+
 # --- MESSAGES ---
 
-@router.get("/channels/{channel_id}/messages", response_model=List[MessageSchema])
-def get_messages(channel_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get("/channels/{channel_id}/messages", response_model=MessagePage)
+def get_messages(
+    channel_id: int,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """One page of history, oldest first.
+
+    Without a cursor returns the newest page; before_id walks back to older
+    messages, after_id forward to newer ones (catching up after a gap).
+    """
     channel = db.query(Channel).filter(Channel.id == channel_id).first()
     if not channel:
         raise HTTPException(status_code=404, detail="Канал не найден")
     
-    if not current_user.is_admin and current_user not in channel.members and channel.created_by != current_user.id:
+    if not can_access_channel(db, current_user, channel):
         raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
     
-    messages = db.query(Message).filter(Message.channel_id == channel_id).all()
-    for msg in messages:
-        msg.username = msg.user.username
-    return messages
+    if before_id is not None and after_id is not None:
+        raise HTTPException(status_code=400, detail="Укажите только before_id или after_id")
 
-@router.post("/channels/{channel_id}/messages", response_model=MessageSchema)
-async def create_message(channel_id: int, message: MessageCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    channel = db.query(Channel).filter(Channel.id == channel_id).first()
-    if not channel:
-        raise HTTPException(status_code=404, detail="Канал не найден")
+    # Seek on the (channel_id, id) index; one extra row tells whether there is more
+    if before_id is None and after_id is None and recent_messages.covers(limit):
+        # Opening a channel: the newest page comes from memory when the channel is hot
+        page = recent_messages.get_page(channel_id, limit)
+        if page is None:
+            generation = recent_messages.generation(channel_id)
+            rows = read_before(db, channel_id, None, recent_messages.depth + 1)
+            items = rows[:recent_messages.depth][::-1]
+            complete = len(rows) <= recent_messages.depth
+            recent_messages.fill(channel_id, generation, items, complete)
+            page = slice_page(items, limit, complete)
+        return page
+    if after_id is not None:
+        messages = read_after(db, channel_id, after_id, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        next_cursor = messages[-1]["id"] if has_more else None
+    else:
+        messages = read_before(db, channel_id, before_id, limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+        next_cursor = messages[0]["id"] if has_more else None
 
-    if not current_user.is_admin and current_user not in channel.members and channel.created_by != current_user.id:
-        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+    return {"items": messages, "has_more": has_more, "next_cursor": next_cursor}
 
-    new_message = Message(
-        channel_id=channel_id,
-        user_id=current_user.id,
-        content=message.content,
-        image_url=message.image_url,
-        thumbnail_url=message.thumbnail_url
-    )
+def with_session(fn, *args):
+    # For the async paths: a short session opened, used and closed on the threadpool thread
+    with SessionLocal() as db:
+        return fn(db, *args)
+
+def store_message(db: Session, values: dict) -> dict:
+    new_message = Message(**values)
     db.add(new_message)
+    db.flush()
+    add_message_counts(db.connection(), [values["channel_id"]])
+    log_changes(db.connection(), "message", "create", [(values["channel_id"], new_message.id)])
+    mark_own_messages_read(db.connection(), [(values["channel_id"], values["user_id"], new_message.id)])
     db.commit()
     db.refresh(new_message)
-    
+    return {**values, "id": new_message.id, "created_at": new_message.created_at}
+
+async def save_message(channel_id: int, user_id: int, username: str, message: MessageCreate) -> dict:
+    # Shared by the HTTP endpoint and the WebSocket "send" frame; access is checked by the caller.
+    # Only the await stays on the event loop: a SQLite lock wait here would stall every socket.
+    values = {
+        "channel_id": channel_id,
+        "user_id": user_id,
+        "content": message.content,
+        "image_url": message.image_url,
+        "thumbnail_url": message.thumbnail_url
+    }
+    if message_writer.enabled:
+        # Batched with other messages arriving in the same window (MESSAGE_GROUP_COMMIT_MS)
+        stored = await message_writer.write(values)
+    else:
+        stored = await run_in_threadpool(with_session, store_message, values)
+
     msg_data = {
-        "id": new_message.id,
-        "channel_id": new_message.channel_id,
-        "user_id": new_message.user_id,
-        "content": new_message.content,
-        "image_url": new_message.image_url,
-        "thumbnail_url": new_message.thumbnail_url,
-        "username": current_user.username,
-        "created_at": new_message.created_at.isoformat()
+        "id": stored["id"],
+        "channel_id": stored["channel_id"],
+        "user_id": stored["user_id"],
+        "content": stored["content"],
+        "image_url": stored["image_url"],
+        "thumbnail_url": stored["thumbnail_url"],
+        "username": username,
+        "created_at": stored["created_at"].isoformat()
     }
     
-    # Broadcast to all connected clients
-    await manager.broadcast({"type": "new_message", "message": msg_data})
-    
-    new_message.username = current_user.username
-    return new_message
+    # Only the channel's audience receives the event
+    manager.broadcast_to_channel(channel_id, {"type": "new_message", "message": msg_data})
+    return msg_data
 
-@router.delete("/messages/{message_id}")
-async def delete_message(message_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+def remove_message(db: Session, message_id: int, user_id: int, is_admin: bool):
     message = db.query(Message).filter(Message.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Сообщение не найдено")
     
-    if message.user_id != current_user.id and not current_user.is_admin:
+    if message.user_id != user_id and not is_admin:
         raise HTTPException(status_code=403, detail="Вы можете удалять только свои сообщения")
     
+    channel_id = message.channel_id
+    message_removed(db, channel_id, message_id)
+    log_changes(db.connection(), "message", "delete", [(channel_id, message_id)])
     db.delete(message)
     db.commit()
     
-    await manager.broadcast({"type": "message_deleted", "id": message_id, "channel_id": message.channel_id})
-    
+    manager.broadcast_to_channel(channel_id, {"type": "message_deleted", "id": message_id, "channel_id": channel_id})
+
+@router.post("/channels/{channel_id}/messages", response_model=MessageSchema)
+async def create_message(channel_id: int, message: MessageCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    await run_in_threadpool(check_post_access, db, current_user, channel_id)
+    return await save_message(channel_id, current_user.id, current_user.username, message)
+
+def check_post_access(db: Session, user: User, channel_id: int):
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+
+    if not can_access_channel(db, user, channel):
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+
+@router.delete("/messages/{message_id}")
+def delete_message(message_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    remove_message(db, message_id, current_user.id, current_user.is_admin)
     return {"detail": "Сообщение удалено"}
 
 # --- WEBSOCKET ---
 
+def channel_exists(db: Session, channel_id: int) -> bool:
+    return db.get(Channel, channel_id) is not None
+
+async def handle_send_frame(connection: Connection, frame: dict) -> dict:
+    channel_id = frame.get("channel_id")
+    if not isinstance(channel_id, int):
+        raise HTTPException(status_code=400, detail="Не указан канал")
+    # connection.channels is the membership set loaded at connect and kept current by the bus
+    if not connection.is_admin and channel_id not in connection.channels:
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+    if connection.is_admin and not await run_in_threadpool(with_session, channel_exists, channel_id):
+        raise HTTPException(status_code=404, detail="Канал не найден")
+    message = MessageCreate(
+        content=frame.get("content") or "",
+        image_url=frame.get("image_url"),
+        thumbnail_url=frame.get("thumbnail_url")
+    )
+    return await save_message(channel_id, connection.user_id, connection.username, message)
+
+async def handle_frame(connection: Connection, frame: dict):
+    """Inbound frames: {"type": "send" | "delete", "temp_id": ...}. Each gets an ack or an error back.
+
+    "typing" and "presence" are answered from memory and never open a DB session;
+    the others do their queries on the threadpool.
+    """
+    frame_type = frame.get("type")
+    if frame_type == "pong":
+        # Liveness only; the receive loop already recorded it
+        return
+    if frame_type in ("typing", "presence"):
+        channel_id = frame.get("channel_id")
+        if not isinstance(channel_id, int) or channel_id not in connection.channels:
+            # Typing is fire-and-forget; no error frame for every keystroke
+            if frame_type == "presence":
+                manager.reply(connection, {"type": "error", "detail": "У вас нет доступа к этому каналу"})
+            return
+        if frame_type == "typing":
+            manager.typing(connection, channel_id)
+        else:
+            manager.reply(connection, {
+                "type": "presence_list",
+                "channel_id": channel_id,
+                "user_ids": manager.online_in_channel(channel_id),
+            })
+        return
+    temp_id = frame.get("temp_id")
+    try:
+        if frame_type == "send":
+            msg_data = await handle_send_frame(connection, frame)
+            manager.reply(connection, {"type": "ack", "temp_id": temp_id, "message": msg_data})
+        elif frame_type == "delete":
+            if not isinstance(frame.get("id"), int):
+                raise HTTPException(status_code=400, detail="Не указано сообщение")
+            await run_in_threadpool(with_session, remove_message, frame["id"], connection.user_id, connection.is_admin)
+            manager.reply(connection, {"type": "ack", "temp_id": temp_id, "id": frame.get("id")})
+        else:
+            manager.reply(connection, {"type": "error", "temp_id": temp_id, "detail": "Неизвестный тип сообщения"})
+    except HTTPException as e:
+        manager.reply(connection, {"type": "error", "temp_id": temp_id, "detail": e.detail})
+    except ValidationError as e:
+        manager.reply(connection, {"type": "error", "temp_id": temp_id, "detail": str(e)})
+
+def authenticate_socket(db: Session, token: str) -> tuple:
+    user = get_user_from_token(token, db)
+    if user is None:
+        return None, None
+    return user, get_accessible_channel_ids(db, user)
+
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = None, resume: Optional[str] = None):
+    # Short-lived session: a socket can stay open for hours and must not pin a DB connection.
+    # Browsers cannot set headers on a WebSocket, so the JWT comes as ?token=
+    user, channel_ids = await run_in_threadpool(with_session, authenticate_socket, token) if token else (None, None)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    # ?resume={"epoch": ..., "seqs": {channel_id: seq}} replays what a reconnecting client missed
+    try:
+        resume_state = json_codec.loads(resume) if resume else None
+    except ValueError:
+        resume_state = None
+    if not isinstance(resume_state, dict):
+        resume_state = None
+    connection = await manager.connect(websocket, user, channel_ids, resume_state)
+    if connection is None:
+        return
     try:
         while True:
-            await websocket.receive_text() # Keep connection alive, maybe implement ping/pong or ignore specific inputs
+            text = await websocket.receive_text()
+            manager.touch(connection)
+            try:
+                frame = json_codec.loads(text)
+            except ValueError:
+                continue
+            if isinstance(frame, dict):
+                await handle_frame(connection, frame)
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
+        pass
+    finally:
+        manager.disconnect(connection)
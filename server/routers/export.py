@@ -0,0 +1,121 @@
+import zlib
+from typing import Iterable, Iterator
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+from database import get_db, SessionLocal
+from models import User, Channel, Message, channel_members
+from channel_access import can_access_channel
+from auth_dependencies import get_current_user, get_current_admin
+from archive import cold_store
+from routers.chat import query_message_rows
+import json_codec
+
+router = APIRouter(
+    tags=["export"]
+)
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_ROWS = 1000
+# Output is handed to the socket in chunks of about this many bytes
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+
+def channel_record(channel) -> dict:
+    return {
+        "type": "channel",
+        "id": channel.id,
+        "name": channel.name,
+        "created_by": channel.created_by,
+        "created_at": channel.created_at.isoformat() if channel.created_at else None,
+    }
+
+
+def message_records(db: Session, channel_id: int) -> Iterator[dict]:
+    """The channel's whole history, oldest first: the cold archive, then the messages table."""
+    for message in cold_store.iter_channel(db, channel_id):
+        yield {"type": "message", **message}
+    rows = query_message_rows(db).filter(
+        Message.channel_id == channel_id
+    ).order_by(Message.id.asc()).yield_per(EXPORT_BATCH_ROWS)
+    for row in rows:
+        message = row._asdict()
+        message["created_at"] = message["created_at"].isoformat() if message["created_at"] else None
+        yield {"type": "message", **message}
+
+
+def full_export_records(db: Session) -> Iterator[dict]:
+    """Users, channels, memberships and messages; readable by the admin import."""
+    for user in db.query(User.id, User.username, User.email, User.is_admin, User.created_at).order_by(User.id).yield_per(EXPORT_BATCH_ROWS):
+        record = user._asdict()
+        record["created_at"] = record["created_at"].isoformat() if record["created_at"] else None
+        yield {"type": "user", **record}
+    channels = db.query(Channel.id, Channel.name, Channel.created_by, Channel.created_at).order_by(Channel.id).all()
+    for channel in channels:
+        yield channel_record(channel)
+    for member in db.query(channel_members.c.channel_id, channel_members.c.user_id).yield_per(EXPORT_BATCH_ROWS):
+        yield {"type": "member", "channel_id": member.channel_id, "user_id": member.user_id}
+    for channel in channels:
+        yield from message_records(db, channel.id)
+
+
+def ndjson_stream(records: Iterable[dict], gzip: bool) -> Iterator[bytes]:
+    """Encodes records one per line and yields ~64 KB chunks, gzipped on the fly if asked."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    buffer = []
+    size = 0
+    for record in records:
+        line = (json_codec.dumps(record) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    chunk = b"".join(buffer)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def export_response(make_records, filename: str, gzip: bool) -> StreamingResponse:
+    def stream():
+        # The request's session is gone by the time the body streams; this one lives as long as the download
+        with SessionLocal() as db:
+            yield from ndjson_stream(make_records(db), gzip)
+
+    if gzip:
+        filename += ".gz"
+    return StreamingResponse(
+        stream(),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/channels/{channel_id}/export")
+def export_channel(channel_id: int, gzip: bool = False, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """Streams the channel's full history as NDJSON: one channel line, then its messages oldest first."""
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+
+    if not can_access_channel(db, current_user, channel):
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+
+    header = channel_record(channel)
+
+    def records(session: Session) -> Iterator[dict]:
+        yield header
+        yield from message_records(session, channel_id)
+
+    return export_response(records, f"channel-{channel_id}.ndjson", gzip)
+
+
+@router.get("/admin/export", dependencies=[Depends(get_current_admin)])
+def export_all(gzip: bool = False):
+    """Streams every user, channel, membership and message as NDJSON."""
+    return export_response(full_export_records, "messager-export.ndjson", gzip)
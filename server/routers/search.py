@@ -0,0 +1,132 @@
+import html
+import re
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+from database import get_db
+from models import User, Channel
+from schemas import SearchPage
+from channel_access import can_access_channel
+from auth_dependencies import get_current_user
+from migrate import PG_SEARCH_CONFIG
+from routers.chat import get_accessible_channel_ids
+
+router = APIRouter(
+    tags=["search"]
+)
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Ranked results are paged by offset; deep pages cost more and nobody reads them
+SEARCH_MAX_OFFSET = 1000
+# More terms than this only slow the query down
+SEARCH_MAX_TERMS = 8
+
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+# The engines wrap matches in these private-use characters; the tags go in after the text is escaped
+MATCH_START = "\ue000"
+MATCH_END = "\ue001"
+
+SQLITE_SEARCH = f"""
+SELECT m.id, m.channel_id, m.user_id, m.content, m.image_url, m.thumbnail_url, m.created_at, u.username,
+       snippet(messages_fts, 0, '{MATCH_START}', '{MATCH_END}', '…', 16) AS snippet
+FROM messages_fts
+JOIN messages m ON m.id = messages_fts.rowid
+LEFT JOIN users u ON u.id = m.user_id
+WHERE messages_fts MATCH :query {{channel_filter}}
+ORDER BY bm25(messages_fts), m.id DESC
+LIMIT :limit OFFSET :offset
+"""
+
+# Rank and page on the GIN index first; ts_headline is expensive, so only the page gets snippets
+POSTGRES_SEARCH = f"""
+SELECT m.id, m.channel_id, m.user_id, m.content, m.image_url, m.thumbnail_url, m.created_at, u.username,
+       ts_headline('{PG_SEARCH_CONFIG}', m.content, to_tsquery('{PG_SEARCH_CONFIG}', :query),
+                   'StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords=24, MinWords=8, MaxFragments=2') AS snippet
+FROM (
+    SELECT id, ts_rank_cd(search_vector, to_tsquery('{PG_SEARCH_CONFIG}', :query)) AS rank
+    FROM messages
+    WHERE search_vector @@ to_tsquery('{PG_SEARCH_CONFIG}', :query) {{channel_filter}}
+    ORDER BY rank DESC, id DESC
+    LIMIT :limit OFFSET :offset
+) hits
+JOIN messages m ON m.id = hits.id
+LEFT JOIN users u ON u.id = m.user_id
+ORDER BY hits.rank DESC, hits.id DESC
+"""
+
+
+def highlight(snippet: str) -> str:
+    """The snippet as safe HTML: message text escaped (imported content never went through
+    MessageCreate), then the engine's match markers turned into <mark> tags."""
+    return html.escape(snippet, quote=False).replace(MATCH_START, HIGHLIGHT_START).replace(MATCH_END, HIGHLIGHT_END)
+
+
+def search_terms(q: str) -> List[str]:
+    # Only word characters reach the engine, so user input cannot break the query syntax
+    terms = re.findall(r"\w+", q.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+    return terms
+
+
+def search_messages(db: Session, q: str, channel_ids: Optional[List[int]], limit: int, offset: int) -> dict:
+    """Ranked matches of every term (as a prefix), limited to channel_ids unless it is None."""
+    terms = search_terms(q)
+    postgres = db.get_bind().dialect.name == "postgresql"
+    if postgres:
+        sql, query = POSTGRES_SEARCH, " & ".join(f"{term}:*" for term in terms)
+        column = "channel_id"
+    else:
+        sql, query = SQLITE_SEARCH, " ".join(f'"{term}"*' for term in terms)
+        column = "m.channel_id"
+
+    params = {"query": query, "limit": limit + 1, "offset": offset}
+    if channel_ids is None:
+        statement = text(sql.format(channel_filter=""))
+    else:
+        statement = text(sql.format(channel_filter=f"AND {column} IN :channel_ids"))
+        statement = statement.bindparams(bindparam("channel_ids", expanding=True))
+        params["channel_ids"] = channel_ids
+
+    rows = db.execute(statement, params).mappings().all()
+    has_more = len(rows) > limit
+    return {
+        "items": [{**row, "snippet": highlight(row["snippet"] or "")} for row in rows[:limit]],
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None,
+    }
+
+
+@router.get("/channels/{channel_id}/search", response_model=SearchPage)
+def search_channel(
+    channel_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    channel = db.query(Channel).filter(Channel.id == channel_id).first()
+    if not channel:
+        raise HTTPException(status_code=404, detail="Канал не найден")
+
+    if not can_access_channel(db, current_user, channel):
+        raise HTTPException(status_code=403, detail="У вас нет доступа к этому каналу")
+
+    return search_messages(db, q, [channel_id], limit, offset)
+
+
+@router.get("/search", response_model=SearchPage)
+def search_all(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Searches every channel the user can read (all of them for admins)."""
+    channel_ids = None if current_user.is_admin else get_accessible_channel_ids(db, current_user)
+    return search_messages(db, q, channel_ids, limit, offset)
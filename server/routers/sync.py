@@ -0,0 +1,92 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from database import get_db
+from models import User, Channel, ChangeLog, Message
+from schemas import SyncPage
+from auth_dependencies import get_current_user
+from archive import cold_store
+from change_log import assign_versions, current_version, pruned_through
+from routers.chat import get_accessible_channel_ids, query_message_rows
+
+router = APIRouter(
+    tags=["sync"]
+)
+
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+
+
+def change_payloads(db: Session, entries: list) -> dict:
+    """The current rows of created messages and channels, by (kind, id); deleted ones are absent.
+
+    Archival removes messages without a tombstone, so ones no longer hot are looked up in the archive.
+    """
+    message_ids = [entry.entity_id for entry in entries if entry.kind == "message" and entry.op == "create"]
+    channel_ids = [entry.channel_id for entry in entries if entry.kind == "channel" and entry.op == "create"]
+    payloads = {}
+    if message_ids:
+        for row in query_message_rows(db).filter(Message.id.in_(message_ids)):
+            payloads[("message", row.id)] = {**row._asdict(), "created_at": row.created_at.isoformat()}
+        archived = {}
+        for entry in entries:
+            if entry.kind == "message" and entry.op == "create" and ("message", entry.entity_id) not in payloads:
+                archived.setdefault(entry.channel_id, []).append(entry.entity_id)
+        for channel_id, ids in archived.items():
+            for message in cold_store.find(db, channel_id, ids):
+                payloads[("message", message["id"])] = message
+    if channel_ids:
+        for channel in db.query(Channel.id, Channel.name, Channel.created_by, Channel.created_at).filter(Channel.id.in_(channel_ids)):
+            payloads[("channel", channel.id)] = {**channel._asdict(), "created_at": channel.created_at.isoformat()}
+    return payloads
+
+
+@router.get("/sync", response_model=SyncPage)
+def sync(
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(SYNC_PAGE_SIZE, ge=1, le=SYNC_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Changes visible to the user after version since, oldest first. Without since, only the current version."""
+    # Versions are in commit order, so everything up to the newest one read here is final
+    assign_versions(db)
+    pruned = pruned_through(db)
+    latest = current_version(db)
+    if since is None:
+        return {"changes": [], "version": max(pruned, latest), "has_more": False}
+    if since < pruned:
+        return {"changes": [], "version": max(pruned, latest), "has_more": False, "reset": True}
+
+    query = db.query(ChangeLog).filter(ChangeLog.version > since, ChangeLog.version <= latest)
+    if not current_user.is_admin:
+        query = query.filter(or_(
+            ChangeLog.channel_id.in_(get_accessible_channel_ids(db, current_user)),
+            # Channels the user has lost access to: deleted ones, and ones they were removed from
+            and_(ChangeLog.kind == "channel", ChangeLog.op == "delete"),
+            and_(ChangeLog.kind == "member", ChangeLog.entity_id == current_user.id),
+        ))
+    entries = query.order_by(ChangeLog.version.asc()).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    payloads = change_payloads(db, entries)
+    changes = []
+    for entry in entries:
+        key = (entry.kind, entry.entity_id if entry.kind == "message" else entry.channel_id)
+        if entry.op == "create" and entry.kind != "member" and key not in payloads:
+            # Deleted since; its tombstone follows
+            continue
+        changes.append({
+            "version": entry.version,
+            "kind": entry.kind,
+            "op": entry.op,
+            "channel_id": entry.channel_id,
+            "entity_id": entry.entity_id,
+            "data": payloads.get(key) if entry.op == "create" else None,
+        })
+
+    # With nothing more to send, skip past changes the user cannot see as well
+    version = entries[-1].version if has_more else max(since, latest)
+    return {"changes": changes, "version": version, "has_more": has_more}
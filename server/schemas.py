@@ -61,9 +61,49 @@ class Channel(ChannelBase):
     class Config:
         from_attributes = True
 
+class MessagePreview(BaseModel):
+    id: int
+    # None once the author's account is deleted
+    user_id: Optional[int] = None
+    username: Optional[str] = None
+    # Cut to CHANNEL_PREVIEW_CHARS
+    content: str
+    created_at: datetime
+
+class ChannelSummary(ChannelBase):
+    # What the channel list needs; the roster is paged separately from /channels/{id}/members
+    id: int
+    created_by: int
+    created_at: datetime
+    member_count: int
+    last_message: Optional[MessagePreview] = None
+    unread_count: int = 0
+    last_read_message_id: Optional[int] = None
+
+class MemberPage(BaseModel):
+    # Ordered by user id; next_cursor goes back as after_id
+    items: List[User]
+    has_more: bool
+    next_cursor: Optional[int] = None
+
+class ReadMarker(BaseModel):
+    # Body of POST /channels/{id}/read; no message_id means "up to the newest"
+    message_id: Optional[int] = None
+
 class MemberAdd(BaseModel):
     username: str
 
+class MembersBulk(BaseModel):
+    # Body of POST / DELETE /channels/{id}/members:bulk; users by name, by id, or both
+    usernames: List[str] = []
+    user_ids: List[int] = []
+
+class MembersBulkResult(BaseModel):
+    # Ids actually added (or removed); unchanged were already members (or were not)
+    user_ids: List[int]
+    unchanged: List[int]
+    not_found: List[str]
+
 # Message Schemas
 class MessageBase(BaseModel):
     content: str
@@ -96,7 +136,7 @@ class MessageCreate(MessageBase):
 class Message(MessageBase):
     id: int
     channel_id: int
-    user_id: int
+    user_id: Optional[int] = None
     created_at: datetime
     # Можно добавить username отправителя для удобства на фронте
     username: Optional[str] = None 
@@ -106,6 +146,39 @@ class Message(MessageBase):
     class Config:
         from_attributes = True
 
+class MessagePage(BaseModel):
+    # Oldest first; next_cursor goes back as before_id (or after_id) to continue in the same direction
+    items: List[Message]
+    has_more: bool
+    next_cursor: Optional[int] = None
+
+class SearchResult(Message):
+    # Matched fragment of content, terms wrapped in <mark>...</mark>
+    snippet: str
+
+class SearchPage(BaseModel):
+    # Best match first; next_offset goes back as offset for the next page
+    items: List[SearchResult]
+    has_more: bool
+    next_offset: Optional[int] = None
+
+class Change(BaseModel):
+    version: int
+    kind: str  # message | channel | member
+    op: str  # create | delete
+    channel_id: Optional[int] = None
+    # Message id, or the user id of a membership change
+    entity_id: Optional[int] = None
+    # The created message or channel; tombstones and membership changes carry none
+    data: Optional[dict] = None
+
+class SyncPage(BaseModel):
+    # version goes back as since; reset means the changes are gone and the client must reload everything
+    changes: List[Change]
+    version: int
+    has_more: bool
+    reset: bool = False
+
 # System Settings Schemas
 class SMTPSettings(BaseModel):
     smtp_host: str
@@ -0,0 +1,90 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import archive
+from archive import Segment, cold_store, write_segment
+from database import Base
+from models import Channel, Message, User
+from read_markers import mark_read
+from routers.sync import change_payloads
+
+def make_channel(old, new):
+    """A session on a fresh database with one channel of `old` month-old and `new` fresh messages."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(username="ann", password_hash="x")
+    db.add(user)
+    db.flush()
+    channel = Channel(name="general", created_by=user.id, message_count=old + new)
+    db.add(channel)
+    db.flush()
+    month_ago = datetime.utcnow() - timedelta(days=30)
+    db.add_all([
+        Message(channel_id=channel.id, user_id=user.id, content=f"m{i}", created_at=month_ago if i < old else datetime.utcnow())
+        for i in range(old + new)
+    ])
+    db.commit()
+    return db, user, channel
+
+def test_segment_reads_across_blocks():
+    messages = [{"id": i * 2, "content": f"message {i}"} for i in range(1, 501)]
+    path = os.path.join(tempfile.mkdtemp(), "channel_1", "segment.seg")
+    write_segment(path, messages)
+    segment = Segment(path)
+
+    assert len(segment.blocks) == -(-len(messages) // archive.BLOCK_MESSAGES)
+    assert [m["id"] for m in segment.before(None, 3)] == [1000, 998, 996]
+    # 401 is not an id: the page starts right below it and crosses a block boundary
+    assert [m["id"] for m in segment.before(401, 3)] == [400, 398, 396]
+    assert [m["id"] for m in segment.after(399, 3)] == [400, 402, 404]
+    assert segment.before(2, 10) == [] and segment.after(1000, 10) == []
+    # Whole blocks from the index, only the block holding 401 is read
+    assert segment.count_after(401) == 300 and segment.count_after(0) == 500 and segment.count_after(1000) == 0
+    assert [m["id"] for m in segment.find([1000, 3, 400, 2])] == [2, 400, 1000]
+    segment.close()
+
+def test_unread_count_includes_archived_messages(monkeypatch):
+    monkeypatch.setattr(cold_store, "root", tempfile.mkdtemp())
+    db, user, channel = make_channel(old=20, new=10)
+    assert cold_store.archive_channel(db, channel.id, datetime.utcnow() - timedelta(days=1)) == 20
+
+    # Message 5 is archived: 15 archived and 10 hot messages come after it
+    assert mark_read(db, user.id, channel, 5)["unread_count"] == 25
+    assert mark_read(db, user.id, channel, None)["unread_count"] == 0
+
+def test_archived_ids_are_not_handed_out_again(monkeypatch):
+    monkeypatch.setattr(cold_store, "root", tempfile.mkdtemp())
+    db, user, channel = make_channel(old=10, new=0)
+    assert cold_store.archive_channel(db, channel.id, datetime.utcnow() - timedelta(days=1)) == 10
+
+    message = Message(channel_id=channel.id, user_id=user.id, content="new")
+    db.add(message)
+    db.commit()
+    assert message.id == 11
+    assert [m["id"] for m in cold_store.read_before(db, channel.id, message.id, 3)] == [10, 9, 8]
+
+def test_evicted_segments_stay_readable(monkeypatch):
+    root = tempfile.mkdtemp()
+    monkeypatch.setattr(cold_store, "root", root)
+    monkeypatch.setattr(archive, "OPEN_SEGMENTS", 1)
+    for name in ("a.seg", "b.seg"):
+        write_segment(os.path.join(root, name), [{"id": 1, "content": name}])
+
+    # A request still holds the first segment when the second one evicts it
+    reading = cold_store.segment("a.seg")
+    cold_store.segment("b.seg")
+    assert [m["content"] for m in reading.after(0, 1)] == ["a.seg"]
+
+def test_sync_finds_messages_archived_since_they_were_logged(monkeypatch):
+    monkeypatch.setattr(cold_store, "root", tempfile.mkdtemp())
+    db, user, channel = make_channel(old=5, new=2)
+    assert cold_store.archive_channel(db, channel.id, datetime.utcnow() - timedelta(days=1)) == 5
+
+    entries = [SimpleNamespace(kind="message", op="create", channel_id=channel.id, entity_id=message_id) for message_id in (4, 5, 6)]
+    payloads = change_payloads(db, entries)
+    assert [payloads[("message", message_id)]["content"] for message_id in (4, 5, 6)] == ["m3", "m4", "m5"]
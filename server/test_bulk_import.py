@@ -0,0 +1,54 @@
+from sqlalchemy import create_engine, select
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import ChangeLog, User, Channel, Message, channel_members
+from bulk_import import BulkImporter
+
+def test_import_maps_ids_and_merges_existing_names():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"username": "admin", "password_hash": "x"}])
+
+    importer = BulkImporter(engine, batch_rows=2)
+    for record in [
+        {"type": "user", "id": 10, "username": "admin"},
+        {"type": "user", "id": 11, "username": "ann", "password_hash": "h"},
+        {"type": "channel", "id": 5, "name": "old", "created_by": 11},
+        {"type": "member", "channel_id": 5, "user_id": 11},
+        {"type": "member", "channel_id": 5, "user_id": 99},
+    ] + [{"type": "message", "channel_id": 5, "user_id": 10 + i % 2, "content": f"m{i}"} for i in range(5)]:
+        importer.feed(record)
+    summary = importer.finish()
+
+    assert (summary["users"], summary["merged"], summary["members"], summary["messages"], summary["skipped"]) == (1, 1, 1, 5, 1)
+    with engine.connect() as conn:
+        ann = conn.execute(select(User.id).where(User.username == "ann")).scalar()
+        channel = conn.execute(select(Channel.id, Channel.created_by).where(Channel.name == "old")).one()
+        assert channel.created_by == ann
+        assert conn.execute(select(channel_members.c.user_id).where(channel_members.c.channel_id == channel.id)).scalars().all() == [ann]
+        authors = conn.execute(select(Message.user_id).where(Message.channel_id == channel.id).order_by(Message.id)).scalars().all()
+        assert authors == [1, ann, 1, ann, 1]
+
+def test_import_skips_incomplete_records_and_existing_members():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"username": "admin", "password_hash": "x"}])
+
+    importer = BulkImporter(engine, owner_id=1)
+    for line in [
+        b'{"type": "user", "username": "zed"}',
+        b'{"type": "user", "id": 11, "username": "ann", "password_hash": "h"}',
+        b'{"type": "channel", "name": "no-id"}',
+        b'{"type": "channel", "id": 5, "name": "old"}',
+        b'{"type": "member", "channel_id": 5, "user_id": 11}',
+        b'{"type": "member", "channel_id": 5, "user_id": 11}',
+        b'{"type": "member", "channel_id": 5}',
+    ]:
+        importer.feed_line(line)
+    summary = importer.finish()
+
+    assert (summary["users"], summary["channels"], summary["members"], summary["skipped"]) == (1, 1, 1, 3)
+    with engine.connect() as conn:
+        assert conn.execute(select(ChangeLog.kind).where(ChangeLog.kind == "member")).scalars().all() == ["member"]
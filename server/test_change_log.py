@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from change_log import current_version, log_changes, prune, pruned_through
+
+def test_versions_keep_growing_after_everything_is_pruned():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with engine.begin() as conn:
+        log_changes(conn, "message", "create", [(1, message_id) for message_id in range(1, 6)])
+
+    with Session() as db:
+        assert current_version(db) == 5
+        assert prune(db, datetime.utcnow() + timedelta(seconds=1)) == 5
+        assert pruned_through(db) == 5 and current_version(db) == 0
+
+    with engine.begin() as conn:
+        log_changes(conn, "message", "create", [(1, 6)])
+    with Session() as db:
+        # A client at version 5 still sees the new change
+        assert current_version(db) == 6
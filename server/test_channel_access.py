@@ -0,0 +1,54 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import User, Channel
+from channel_access import ChannelAccessCache, can_access_channel, channel_access
+
+def test_access_check_never_loads_members():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        owner, outsider = User(username="owner", password_hash="x"), User(username="outsider", password_hash="x")
+        members = [User(username=f"user{i}", password_hash="x") for i in range(30)]
+        db.add_all([owner, outsider, *members])
+        db.flush()
+        channel = Channel(name="general", created_by=owner.id, members=members)
+        db.add(channel)
+        db.commit()
+        ids = members[0].id, outsider.id, channel.id
+
+    channel_access.apply_event({"op": "invalidate_access"})
+    with Session() as db:
+        member, outsider, channel = db.get(User, ids[0]), db.get(User, ids[1]), db.get(Channel, ids[2])
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        assert can_access_channel(db, member, channel) and not can_access_channel(db, outsider, channel)
+        assert len(statements) == 2 and not any("FROM users" in statement for statement in statements)
+        # Cached now, until the bus says otherwise
+        assert can_access_channel(db, member, channel) and not can_access_channel(db, outsider, channel)
+        assert len(statements) == 2
+
+def test_bus_events_invalidate_decisions():
+    cache = ChannelAccessCache(max_entries=2, ttl=60)
+    cache.put(1, 10, True, cache.generation(1, 10))
+    cache.apply_event({"op": "unsubscribe", "user_id": 1, "channel_id": 10})
+    assert cache.get(1, 10) is None
+
+    # A bulk membership change is one event for all the users in it
+    cache.put(4, 10, False, cache.generation(4, 10))
+    cache.put(5, 10, True, cache.generation(5, 10))
+    cache.apply_event({"op": "members", "channel_id": 10, "added": [4], "removed": [5]})
+    assert cache.get(4, 10) is None and cache.get(5, 10) is None
+
+    # A lookup that started before an event must not be stored
+    generation = cache.generation(2, 10)
+    cache.apply_event({"op": "drop_channel", "channel_id": 10})
+    cache.put(2, 10, True, generation)
+    assert cache.get(2, 10) is None
+
+    cache.put(3, 10, True, cache.generation(3, 10))
+    cache.put(3, 11, False, cache.generation(3, 11))
+    cache.put(3, 12, False, cache.generation(3, 12))
+    assert cache.get(3, 10) is None and cache.get(3, 12) is False
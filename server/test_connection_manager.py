@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+from connection_manager import Connection, ConnectionManager
+from event_bus import InProcessEventBus, PG_MAX_PAYLOAD
+import json_codec
+
+def test_events_published_off_the_loop_are_applied_on_it():
+    async def run():
+        manager = ConnectionManager(InProcessEventBus())
+        await manager.start()
+        applied = []
+        manager.add_listener(lambda event: applied.append((event["op"], threading.current_thread())))
+        # What a sync endpoint does from the threadpool
+        await asyncio.to_thread(manager.send_to_user, 1, {"type": "channel_read"})
+        await asyncio.to_thread(manager.unsubscribe, 1, 2)
+        await asyncio.sleep(0)
+        manager.subscribe(1, 3)
+        await manager.stop()
+        return applied
+
+    applied = asyncio.run(run())
+    assert applied == [("user", threading.main_thread()), ("unsubscribe", threading.main_thread()), ("subscribe", threading.main_thread())]
+
+def test_bulk_membership_events_fit_in_a_notify():
+    published = []
+    manager = ConnectionManager(SimpleNamespace(publish=published.append))
+    manager.change_members(7, added=range(100000, 104000), removed=range(200000, 201000))
+
+    assert all(len(json_codec.dumps(event).encode("utf-8")) <= PG_MAX_PAYLOAD for event in published)
+    assert sum(len(event["added"]) + len(event["removed"]) for event in published) == 5000
+    assert [user_id for event in published for user_id in event["removed"]] == list(range(200000, 201000))
+
+def test_dropped_and_changed_users_lose_their_sockets():
+    class FakeWebSocket:
+        def __init__(self):
+            self.close_code = None
+
+        async def close(self, code):
+            self.close_code = code
+
+    async def run():
+        manager = ConnectionManager(InProcessEventBus())
+        await manager.start()
+        sockets = {}
+        for user_id in (1, 2):
+            sockets[user_id] = FakeWebSocket()
+            connection = Connection(sockets[user_id], user_id, f"user{user_id}")
+            manager.active_connections.add(connection)
+            manager.user_connections[user_id] = {connection}
+            manager._add_subscription(connection, 5)
+        manager.drop_user(1)
+        manager.refresh_user(2)
+        await asyncio.sleep(0.01)
+        await manager.stop()
+        return manager, sockets
+
+    manager, sockets = asyncio.run(run())
+    assert sockets[1].close_code == 1008 and sockets[2].close_code == 1012
+    assert not manager.user_connections and not manager.active_connections and not manager.channel_subscribers.get(5)
+
+def test_replay_buffers_share_one_byte_budget():
+    async def run():
+        manager = ConnectionManager(InProcessEventBus())
+        manager.max_history_bytes = 1000
+        for channel_id in (1, 2, 3):
+            for n in range(5):
+                manager._channel_event(channel_id, {"type": "new_message", "text": "x" * 50})
+        connection = Connection(SimpleNamespace(), 1, "ann")
+        connection.channels.update({1, 3})
+        manager._greet(connection, {"epoch": manager.epoch, "seqs": {"1": 2, "3": 2}})
+        return manager, [connection.queue.get_nowait() for _ in range(connection.queue.qsize())]
+
+    manager, frames = asyncio.run(run())
+    # Channel 1 was the least recently active: its buffer went, channel 3's is still there
+    assert list(manager.history) == [2, 3] and manager.stats["replay_buffers_evicted"] == 1
+    assert manager.history_bytes == sum(len(frame) for history in manager.history.values() for _, frame in history) <= 1000
+    assert [json_codec.loads(frame)["seq"] for frame in frames[1:-1]] == [3, 4, 5]
+    assert json_codec.loads(frames[-1]) == {"type": "resync", "channel_ids": [1]}
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+from event_bus import PG_MAX_PAYLOAD, PostgresEventBus
+import json_codec
+
+class FakeConnection:
+    """Just enough of a psycopg2 connection: a table of stored payloads and a NOTIFY log."""
+
+    def __init__(self):
+        self.closed = False
+        self.stored = {}
+        self.notifies = []
+
+    def poll(self):
+        pass
+
+    def cursor(self):
+        return FakeCursor(self)
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=()):
+        if sql.startswith("INSERT"):
+            ref = len(self.conn.stored) + 1
+            self.conn.stored[ref] = params[0]
+            self.row = (ref,)
+        elif sql.startswith("SELECT payload"):
+            payload = self.conn.stored.get(params[0])
+            self.row = (payload,) if payload is not None else None
+        elif "pg_notify" in sql:
+            self.conn.notifies.append(SimpleNamespace(payload=params[1]))
+
+    def fetchone(self):
+        return self.row
+
+def test_oversized_events_go_by_reference():
+    conn = FakeConnection()
+    bus = PostgresEventBus("postgresql://unused")
+    bus._publish_conn = bus._listen_conn = conn
+    received = []
+    bus._handler = received.append
+
+    small = {"op": "user", "user_id": 1, "message": {"type": "ping"}}
+    large = {"op": "members", "channel_id": 1, "added": list(range(10000, 15000)), "removed": []}
+    bus._notify(json_codec.dumps(small))
+    bus._notify(json_codec.dumps(large))
+
+    assert all(len(notify.payload.encode("utf-8")) <= PG_MAX_PAYLOAD for notify in conn.notifies)
+    assert json_codec.loads(conn.notifies[1].payload) == {"ref": 1}
+    bus._on_readable()
+    assert received == [small, large]
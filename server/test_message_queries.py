@@ -0,0 +1,90 @@
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import User, Channel, Message
+from routers.chat import get_channels, get_messages
+from schemas import ChannelSummary
+from message_cache import RecentMessagesCache, recent_messages
+
+def count_queries(authors):
+    """Runs get_messages on a channel with one message per author and counts the SQL statements."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    with Session() as db:
+        admin = User(username="admin", password_hash="x", is_admin=True)
+        db.add(admin)
+        db.flush()
+        channel = Channel(name="general", created_by=admin.id)
+        db.add(channel)
+        db.flush()
+        for i in range(authors):
+            author = User(username=f"user{i}", password_hash="x")
+            db.add(author)
+            db.flush()
+            db.add(Message(channel_id=channel.id, user_id=author.id, content=f"hello {i}"))
+        db.commit()
+        admin_id, channel_id = admin.id, channel.id
+
+    # Fresh session and a cold message cache: the page has to come from the database
+    recent_messages.apply_event({"op": "invalidate_messages"})
+    with Session() as db:
+        current_user = db.get(User, admin_id)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        page = get_messages(channel_id, before_id=None, after_id=None, limit=50, db=db, current_user=current_user)
+
+    assert [message["username"] for message in page["items"]] == [f"user{i}" for i in range(authors)]
+    return len(statements)
+
+def test_message_queries_do_not_grow_with_authors():
+    assert count_queries(1) == count_queries(30)
+
+def count_channel_list_queries(members):
+    """Runs get_channels over three channels with members each and counts the SQL statements."""
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    with Session() as db:
+        admin = User(username="admin", password_hash="x", is_admin=True)
+        users = [User(username=f"user{i}", password_hash="x") for i in range(members)]
+        db.add_all([admin, *users])
+        db.flush()
+        for n in range(3):
+            channel = Channel(name=f"channel{n}", created_by=admin.id, members=users, message_count=1)
+            db.add(channel)
+            db.flush()
+            # The last channel's newest message is by a deleted user
+            db.add(Message(channel_id=channel.id, user_id=users[0].id if n < 2 else None, content="x" * 500))
+        db.commit()
+        admin_id = admin.id
+
+    with Session() as db:
+        current_user = db.get(User, admin_id)
+        statements = []
+        event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+        channels = get_channels(db=db, current_user=current_user)
+
+    assert [channel["member_count"] for channel in channels] == [members] * 3
+    assert [channel["last_message"]["username"] for channel in channels] == ["user0", "user0", None]
+    # What the response model checks
+    assert ChannelSummary.model_validate(channels[2]).last_message.user_id is None
+    return len(statements)
+
+def test_channel_list_queries_do_not_grow_with_members():
+    assert count_channel_list_queries(1) == count_channel_list_queries(30)
+
+def test_cached_page_is_refilled_after_ttl():
+    cache = RecentMessagesCache(max_bytes=1 << 20, depth=10, ttl=60)
+    cache.fill(1, cache.generation(1), [{"id": 1, "content": "a"}], complete=True)
+    assert [message["id"] for message in cache.get_page(1, 10)["items"]] == [1]
+
+    # An event this worker never received would otherwise stay missing for as long as the entry lives
+    cache.entries[1].expires_at -= 61
+    assert cache.get_page(1, 10) is None and cache.stats["expired"] == 1
+
+if __name__ == "__main__":
+    print(f"1 author: {count_queries(1)} queries, 30 authors: {count_queries(30)} queries")
@@ -0,0 +1,104 @@
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+from database import Base
+import models  # noqa: F401 (registers the tables)
+from migrate import MIGRATIONS, run_migrations
+from routers.search import search_messages
+
+def make_engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+def query_plan(engine, sql, **params):
+    with engine.connect() as conn:
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).all()
+    return " ".join(row[-1] for row in rows)
+
+def test_migrations_upgrade_legacy_schema_once():
+    engine = make_engine()
+    with engine.begin() as conn:
+        # What a database from before the migration runner looks like
+        conn.execute(text("DROP INDEX ix_messages_channel_id_id"))
+        conn.execute(text("DROP INDEX ix_channel_members_channel_id_user_id"))
+        conn.execute(text("DROP INDEX ix_audit_logs_timestamp"))
+        conn.execute(text("ALTER TABLE messages DROP COLUMN thumbnail_url"))
+        conn.execute(text("ALTER TABLE channels DROP COLUMN message_count"))
+        conn.execute(text("DROP TABLE channel_reads"))
+        conn.execute(text("INSERT INTO users (id, username) VALUES (7, 'ann'), (8, 'bob')"))
+        conn.execute(text("INSERT INTO channels (id, name) VALUES (1, 'general'), (2, 'Общий')"))
+        conn.execute(text("INSERT INTO channel_members (user_id, channel_id) VALUES (7, 1)"))
+        conn.execute(text("INSERT INTO messages (id, channel_id, user_id, content) VALUES (1, 1, 7, 'a'), (2, 1, 7, 'b')"))
+
+    assert run_migrations(engine) == sorted(version for version, _, _ in MIGRATIONS)
+    assert run_migrations(engine) == []
+    assert "thumbnail_url" in {column["name"] for column in inspect(engine).get_columns("messages")}
+    with engine.connect() as conn:
+        # Counters are backfilled and existing members start with nothing unread
+        assert conn.execute(text("SELECT message_count FROM channels WHERE id = 1")).scalar() == 2
+        markers = conn.execute(text("SELECT user_id, channel_id, last_read_message_id, read_count FROM channel_reads ORDER BY user_id, channel_id")).all()
+        # Everyone ends up in the default channel, with a marker like any new member
+        assert markers == [(7, 1, 2, 2), (7, 2, 0, 0), (8, 2, 0, 0)]
+        assert conn.execute(text("SELECT user_id FROM channel_members WHERE channel_id = 2 ORDER BY user_id")).scalars().all() == [7, 8]
+
+def test_hot_queries_use_indexes():
+    engine = make_engine()
+    run_migrations(engine)
+
+    plan = query_plan(engine, "SELECT id FROM messages WHERE channel_id = :c AND id < :b ORDER BY id DESC LIMIT 51", c=1, b=100)
+    assert "ix_messages_channel_id_id" in plan and "TEMP B-TREE" not in plan
+
+    plan = query_plan(engine, "SELECT user_id FROM channel_members WHERE channel_id = :c", c=1)
+    assert "ix_channel_members_channel_id_user_id" in plan
+
+    plan = query_plan(engine, "SELECT 1 FROM channel_members WHERE channel_id = :c AND user_id = :u", c=1, u=1)
+    assert "SCAN" not in plan
+
+    plan = query_plan(engine, "SELECT id FROM audit_logs ORDER BY timestamp DESC LIMIT 50")
+    assert "ix_audit_logs_timestamp" in plan
+
+def test_search_index_follows_messages():
+    engine = make_engine()
+    run_migrations(engine)
+    match = "SELECT rowid FROM messages_fts WHERE messages_fts MATCH :q"
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO messages (id, channel_id, user_id, content) VALUES (1, 1, 1, 'Созвон по релизу')"))
+        assert conn.execute(text(match), {"q": '"релиз"*'}).scalars().all() == [1]
+        conn.execute(text("UPDATE messages SET content = 'отменили' WHERE id = 1"))
+        assert conn.execute(text(match), {"q": '"релиз"*'}).scalars().all() == []
+        conn.execute(text("DELETE FROM messages WHERE id = 1"))
+        assert conn.execute(text(match), {"q": '"отменили"'}).scalars().all() == []
+
+    assert "VIRTUAL TABLE INDEX" in query_plan(engine, match, q='"релиз"*')
+
+def test_search_snippets_escape_message_text():
+    engine = make_engine()
+    run_migrations(engine)
+    with engine.begin() as conn:
+        # Bulk-imported content is stored as is
+        conn.execute(text("INSERT INTO messages (id, channel_id, user_id, content) VALUES (1, 1, 1, '<img src=x onerror=alert(1)> релиз')"))
+    with Session(engine) as db:
+        [item] = search_messages(db, "релиз", None, 10, 0)["items"]
+    assert item["snippet"] == "&lt;img src=x onerror=alert(1)&gt; <mark>релиз</mark>"
+
+def test_message_ids_are_not_reused_after_upgrade():
+    engine = make_engine()
+    with engine.begin() as conn:
+        # A messages table from before AUTOINCREMENT, whose ids 3-10 were archived
+        conn.execute(text("DROP TABLE messages"))
+        conn.execute(text(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, channel_id INTEGER, user_id INTEGER, "
+            "content TEXT, image_url VARCHAR, thumbnail_url VARCHAR, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO messages (id, channel_id, user_id, content) VALUES (1, 1, 1, 'релиз'), (2, 1, 1, 'b')"))
+        conn.execute(text("INSERT INTO archive_segments (channel_id, first_id, last_id, message_count) VALUES (1, 3, 10, 8)"))
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM messages WHERE id = 2"))
+        new_id = conn.execute(text("INSERT INTO messages (channel_id, user_id, content) VALUES (1, 1, 'новый релиз') RETURNING id")).scalar()
+        assert new_id == 11
+        # Search triggers are back on the rebuilt table
+        found = conn.execute(text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH :q ORDER BY rowid"), {"q": '"релиз"'}).scalars().all()
+        assert found == [1, 11]
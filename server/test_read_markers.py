@@ -0,0 +1,46 @@
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from database import Base
+from models import Channel, ChannelRead, User
+from message_writer import GroupCommitWriter
+from bulk_import import BulkImporter
+from read_markers import unread_counts
+
+def make_engine():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{"id": 1, "username": "ann", "password_hash": "x"}, {"id": 2, "username": "bob", "password_hash": "x"}])
+        conn.execute(Channel.__table__.insert(), [{"id": 1, "name": "general", "created_by": 1}])
+    return engine
+
+def unread(engine, user_id):
+    with sessionmaker(bind=engine)() as db:
+        channels = db.query(Channel).all()
+        return {channel_id: counts["unread_count"] for channel_id, counts in unread_counts(db, user_id, channels).items()}
+
+def test_authors_have_read_their_own_messages():
+    engine = make_engine()
+    writer = GroupCommitWriter(engine, 5)
+    # One batch: ann, bob, ann; ann has read up to her second post, bob only up to his own
+    writer._insert([{"channel_id": 1, "user_id": user_id, "content": "hi"} for user_id in (1, 2, 1)])
+
+    assert unread(engine, 1) == {1: 0} and unread(engine, 2) == {1: 1}
+    with engine.connect() as conn:
+        assert conn.execute(select(ChannelRead.user_id, ChannelRead.last_read_message_id).order_by(ChannelRead.user_id)).all() == [(1, 3), (2, 2)]
+
+def test_imported_members_start_caught_up():
+    engine = make_engine()
+    importer = BulkImporter(engine, owner_id=1)
+    for record in [
+        {"type": "user", "id": 10, "username": "cat"},
+        {"type": "channel", "id": 5, "name": "old", "created_by": 10},
+        {"type": "member", "channel_id": 5, "user_id": 10},
+    ] + [{"type": "message", "channel_id": 5, "user_id": 10, "content": f"m{i}"} for i in range(3)]:
+        importer.feed(record)
+    importer.finish()
+
+    with engine.connect() as conn:
+        cat = conn.execute(select(User.id).where(User.username == "cat")).scalar()
+    assert set(unread(engine, cat).values()) == {0}